@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from collections import deque
+from flask import current_app, g, has_app_context, jsonify, render_template, request
+from metrics import Counter, Gauge, Histogram, metrics
+
+logger = logging.getLogger(__name__)
+
+# Route classes, highest priority first: a freed slot goes to the first class with a request waiting
+PRIORITY = ('checkout', 'cart', 'catalog')
+
+
+class _Ticket:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class _RouteClass:
+    def __init__(self, name, concurrency, queue_size, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = deque()
+
+
+class _Limiter:
+    """One app's route classes, slot counts and wait queues."""
+
+    def __init__(self, classes, routes, max_active, retry_after):
+        self.classes = classes
+        self.routes = routes
+        self.max_active = max_active
+        self.retry_after = retry_after
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def classify(self, endpoint, method):
+        name = self.routes.get(endpoint)
+        if name is None:
+            return None
+        # Page views of the cart and checkout are reads; only their POSTs are writes
+        return name if method == 'POST' else 'catalog'
+
+    def snapshot(self, field):
+        with self.lock:
+            return {
+                (name,): len(route_class.waiting) if field == 'waiting' else route_class.active
+                for name, route_class in self.classes.items()
+            }
+
+    def _grant(self, route_class):
+        route_class.active += 1
+        self.active += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiting requests, highest-priority class first. Call with the lock held."""
+        while self.active < self.max_active:
+            for name in PRIORITY:
+                route_class = self.classes.get(name)
+                if route_class and route_class.waiting and route_class.active < route_class.concurrency:
+                    ticket = route_class.waiting.popleft()
+                    ticket.granted = True
+                    self._grant(route_class)
+                    ticket.event.set()
+                    break
+            else:
+                return
+
+    def acquire(self, name):
+        """Take a slot; returns (reason it was refused or None, seconds spent queued or None)."""
+        route_class = self.classes.get(name)
+        if route_class is None:
+            return None, None
+        with self.lock:
+            if self.active < self.max_active and route_class.active < route_class.concurrency:
+                self._grant(route_class)
+                return None, None
+            if len(route_class.waiting) >= route_class.queue_size:
+                return 'queue_full', None
+            ticket = _Ticket()
+            route_class.waiting.append(ticket)
+        started = time.perf_counter()
+        ticket.event.wait(route_class.timeout)
+        with self.lock:
+            if not ticket.granted:
+                route_class.waiting.remove(ticket)
+                return 'timeout', None
+        return None, time.perf_counter() - started
+
+    def release(self, name):
+        route_class = self.classes.get(name)
+        if route_class is None:
+            return
+        with self.lock:
+            route_class.active -= 1
+            self.active -= 1
+            self._dispatch()
+
+
+class AdmissionControl:
+    """Per-route-class concurrency limits with bounded wait queues.
+
+    Requests are sorted into `checkout` (POST /checkout), `cart` (cart and
+    coupon POSTs) and `catalog` (GETs of storefront pages and catalog APIs);
+    anything else is not limited. Each class may run ADMISSION_LIMITS
+    concurrency requests at once, within ADMISSION_MAX_ACTIVE for all of
+    them, and park up to its queue size more for at most its timeout. When a
+    slot frees, waiting checkouts go first, then cart writes, then reads.
+    A request that finds its queue full, or times out in it, gets an
+    immediate 503 with Retry-After instead of holding a worker thread and a
+    pool connection. Limits are per process, like the metrics.
+    """
+
+    def __init__(self, app=None):
+        self.rejected = Counter(
+            'http_admission_rejected_total', 'Requests shed with a 503 by admission control.', ('route_class', 'reason'))
+        self.wait_time = Histogram(
+            'http_admission_wait_seconds', 'Time admitted requests spent queued.', ('route_class',))
+        self.queue_depth = Gauge(
+            'http_admission_queue_depth', 'Requests waiting for a slot.', ('route_class',),
+            lambda: self._snapshot('waiting'))
+        self.in_flight = Gauge(
+            'http_admission_active', 'Requests holding a slot.', ('route_class',),
+            lambda: self._snapshot('active'))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ADMISSION_ENABLED", True)
+        app.config.setdefault("ADMISSION_MAX_ACTIVE", 24)
+        # class -> (concurrent requests, queued requests, seconds a request may wait)
+        app.config.setdefault("ADMISSION_LIMITS", {
+            'checkout': (12, 64, 10.0),
+            'cart': (8, 32, 3.0),
+            'catalog': (16, 32, 1.0)
+        })
+        app.config.setdefault("ADMISSION_ROUTES", {
+            'checkout': ('checkout',),
+            'cart': ('cart', 'cart_batch', 'apply_coupon'),
+            'catalog': ('index', 'shop', 'get_products', 'product_recommendations', 'search_suggest')
+        })
+        app.config.setdefault("ADMISSION_RETRY_AFTER", 2)
+        if not app.config["ADMISSION_ENABLED"]:
+            return
+        classes = {
+            name: _RouteClass(name, int(concurrency), int(queue_size), float(timeout))
+            for name, (concurrency, queue_size, timeout) in app.config["ADMISSION_LIMITS"].items()
+        }
+        if set(app.config["ADMISSION_ROUTES"]) - set(classes) or set(classes) - set(PRIORITY):
+            raise ValueError(f"ADMISSION_ROUTES and ADMISSION_LIMITS must use the classes {', '.join(PRIORITY)}")
+        routes = {
+            endpoint: name for name, endpoints in app.config["ADMISSION_ROUTES"].items() for endpoint in endpoints
+        }
+        app.extensions['admission'] = _Limiter(
+            classes, routes, int(app.config["ADMISSION_MAX_ACTIVE"]), int(app.config["ADMISSION_RETRY_AFTER"])
+        )
+        app.before_request(self._admit)
+        app.teardown_request(self._leave)
+        metrics.register(self.rejected, self.wait_time, self.queue_depth, self.in_flight)
+
+    def _limiter(self):
+        return current_app.extensions.get('admission') if has_app_context() else None
+
+    def classify(self, endpoint, method):
+        """Return the route class of a request, or None when it is not limited."""
+        limiter = self._limiter()
+        return limiter.classify(endpoint, method) if limiter else None
+
+    def _snapshot(self, field):
+        limiter = self._limiter()
+        return limiter.snapshot(field) if limiter else {}
+
+    def acquire(self, name):
+        """Take a slot for a request of class `name`; returns None, or the reason it was refused."""
+        reason, waited = self._limiter().acquire(name)
+        if waited is not None:
+            self.wait_time.observe(waited, name)
+        return reason
+
+    def release(self, name):
+        self._limiter().release(name)
+
+    def _admit(self):
+        name = self.classify(request.endpoint, request.method)
+        if name is None:
+            return None
+        reason = self.acquire(name)
+        if reason is None:
+            g.admission_class = name
+            return None
+        self.rejected.inc(name, reason)
+        logger.warning(f"Shed {request.method} {request.path} ({name}: {reason.replace('_', ' ')})")
+        if request.method == 'GET' and not request.is_json:
+            body = render_template("error.html", error="We are very busy right now. Please try again shortly.")
+        else:
+            body = jsonify({'error': 'Server busy, please retry shortly'})
+        return body, 503, {'Retry-After': str(self._limiter().retry_after)}
+
+    def _leave(self, exc=None):
+        name = g.pop('admission_class', None)
+        if name is not None:
+            self.release(name)
+
+
+admission = AdmissionControl()
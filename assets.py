@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+from flask import current_app, request, send_from_directory, url_for
+from werkzeug.exceptions import NotFound
+
+try:
+    import brotli
+except ImportError:  # Optional: only gzip variants are built without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.xml', '.ico', '.ttf', '.eot'}
+# Encodings in order of preference, with the suffix of their precompressed file
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprint(path, data):
+    """Insert a short content hash before the extension: css/style.css -> css/style.1a2b3c4d5e.css."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+def build_assets(static_folder, output='dist'):
+    """Copy every static file into `output` under a fingerprinted name, with .gz/.br variants.
+
+    Returns the manifest (source path -> fingerprinted path, relative to the
+    static folder's `output` directory), which is also written to
+    `<output>/manifest.json`.
+    """
+    out_dir = os.path.join(static_folder, output)
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    manifest = {}
+    saved = 0
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = sorted(d for d in dirnames if os.path.join(dirpath, d) != out_dir)
+        for filename in sorted(filenames):
+            source = os.path.join(dirpath, filename)
+            name = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as file:
+                data = file.read()
+            hashed = fingerprint(name, data)
+            target = os.path.join(out_dir, hashed)
+            _write(target, data)
+            manifest[name] = hashed
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+                continue
+            # mtime=0 keeps the .gz byte-identical across builds
+            variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                if len(compressed) < len(data):
+                    _write(target + suffix, compressed)
+                    saved += len(data) - len(compressed)
+    _write(os.path.join(out_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    logger.info(f"Built {len(manifest)} assets into {out_dir} "
+                f"({'gzip + brotli' if brotli else 'gzip'}, {saved / 1024:.0f} KiB saved by compression)")
+    return manifest
+
+
+class _Manifest:
+    """The fingerprinted files of one app's assets directory."""
+
+    def __init__(self, directory, max_age):
+        self.directory = directory
+        self.max_age = max_age
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, 'manifest.json')) as file:
+                self.files = json.load(file)
+        except FileNotFoundError:
+            self.files = {}
+        self.served = set(self.files.values())
+
+
+class Assets:
+    """Serves fingerprinted, precompressed static files listed in a build manifest.
+
+    `asset_url('css/style.css')` in templates resolves to the fingerprinted
+    copy when the manifest has it and falls back to the plain static URL
+    otherwise, so a checkout without `flask build-assets` still works.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ASSETS_DIR", "dist")
+        app.config.setdefault("ASSETS_MAX_AGE", 365 * 24 * 3600)
+        manifest = app.extensions['assets'] = _Manifest(
+            os.path.join(app.static_folder, app.config["ASSETS_DIR"]), int(app.config["ASSETS_MAX_AGE"])
+        )
+        app.add_template_global(self.url, 'asset_url')
+        app.add_url_rule(
+            f"{app.static_url_path}/{app.config['ASSETS_DIR']}/<path:filename>", 'assets', self.serve
+        )
+
+        @app.cli.command('build-assets')
+        def build():
+            """Fingerprint and precompress static/ into the assets directory."""
+            build_assets(app.static_folder, app.config["ASSETS_DIR"])
+            manifest.load()
+
+    def url(self, filename):
+        hashed = current_app.extensions['assets'].files.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=hashed)
+
+    def serve(self, filename):
+        """Send the best precompressed variant the client accepts, cached for ASSETS_MAX_AGE."""
+        manifest = current_app.extensions['assets']
+        if filename not in manifest.served:
+            raise NotFound()
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accepted = request.accept_encodings
+        for encoding, suffix in ENCODINGS:
+            if accepted[encoding] and os.path.exists(os.path.join(manifest.directory, filename + suffix)):
+                response = send_from_directory(
+                    manifest.directory, filename + suffix, mimetype=mimetype, max_age=manifest.max_age
+                )
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(manifest.directory, filename, mimetype=mimetype, max_age=manifest.max_age)
+        response.headers['Cache-Control'] = f'public, max-age={manifest.max_age}, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+assets = Assets()
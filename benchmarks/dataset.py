@@ -0,0 +1,83 @@
+"""Deterministic synthetic catalog, customers and order history for benchmarks."""
+import logging
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import insert, text
+from db import db, Products, Customers, Sales, SaleDetails, Payments, Coupons
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ('devices', 'jackets', 'lamps', 'shoes', 'bags', 'watches', 'kitchen', 'toys', 'books', 'garden')
+ADJECTIVES = ('blue', 'classic', 'smart', 'leather', 'wireless', 'vintage', 'compact', 'premium', 'travel', 'solar')
+NOUNS = ('camera', 'jacket', 'lamp', 'sneaker', 'backpack', 'watch', 'kettle', 'robot', 'novel', 'planter')
+PAYMENT_METHODS = ('mpesa', 'card', 'paypal', 'cash')
+COUPON_CODE = 'BENCH10'
+BATCH = 2000
+
+
+def _chunks(rows, size=BATCH):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _insert(model, rows):
+    for chunk in _chunks(rows):
+        db.session.execute(insert(model), chunk)
+
+
+def build_dataset(products=5000, customers=2000, orders=20000, seed=42):
+    """Drop and recreate all tables, then fill them. Call inside an app context."""
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+
+    product_rows = []
+    for product_id in range(1, products + 1):
+        price = Decimal(rng.randrange(100, 50000)).quantize(Decimal('1.00'))
+        product_rows.append({
+            'product_id': product_id,
+            'product_name': f"{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS).title()} {product_id}",
+            'buying_price': (price * Decimal('0.8')).quantize(Decimal('1.00')),
+            'selling_price': price,
+            'stock_quantity': 1000000,  # Checkout scenarios must never run out
+            'image': f"img/product-{product_id % 8 + 1}.jpg",
+            'category': rng.choice(CATEGORIES),
+            'rating': Decimal(rng.randrange(10, 51)) / 10,
+            'description': f"A {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} for everyday use."
+        })
+    _insert(Products, product_rows)
+
+    _insert(Customers, [
+        {'customer_id': i, 'full_name': f"Customer {i}", 'phone_no': f"07{i:08d}"[:13], 'email': f"customer{i}@example.com"}
+        for i in range(1, customers + 1)
+    ])
+
+    now = datetime.utcnow()
+    sales, details, payments = [], [], []
+    for sale_id in range(1, orders + 1):
+        customer_id = rng.randrange(1, customers + 1)
+        total = Decimal(0)
+        for product in rng.sample(product_rows, rng.randrange(1, 4)):
+            quantity = rng.randrange(1, 4)
+            amount = product['selling_price'] * quantity
+            total += amount
+            details.append({'sale_id': sale_id, 'product_id': product['product_id'], 'quantity': quantity, 'purchase_amount': amount})
+        sales.append({
+            'sale_id': sale_id, 'customer_id': customer_id, 'total_amount': total,
+            'created_at': now - timedelta(minutes=rng.randrange(5, 90 * 24 * 60))
+        })
+        payments.append({'sale_id': sale_id, 'customer_id': customer_id, 'payment_method': rng.choice(PAYMENT_METHODS), 'amount': total})
+    _insert(Sales, sales)
+    _insert(SaleDetails, details)
+    _insert(Payments, payments)
+
+    db.session.add(Coupons(code=COUPON_CODE, discount=10))
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Ids were inserted explicitly; move the sequences past them so new orders get fresh ids
+        for table, column in (('products', 'product_id'), ('customers', 'customer_id'), ('sales', 'sale_id')):
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), (SELECT max({column}) FROM {table}))"
+            ))
+    db.session.commit()
+    logger.info(f"Built dataset: {products} products, {customers} customers, {orders} orders")
@@ -0,0 +1,266 @@
+"""Query-plan regression check for the storefront's hot paths.
+
+    python benchmarks/query_plans.py                       # seed a SQLite file under instance/, check every scenario
+    python benchmarks/query_plans.py --reuse --max-scan-rows 500
+    python benchmarks/query_plans.py --database-uri postgresql://... --reset
+
+Runs each scenario (a page request or a background job) against a seeded
+database, captures the SQL it issues and runs EXPLAIN on every SELECT,
+UPDATE and DELETE. A statement fails the check when its plan reads a table
+of more than --max-scan-rows rows sequentially: `SCAN <table>` (with or
+without a non-covering index) on SQLite, a `Seq Scan` node on Postgres.
+Index-only scans pass, and so do scans feeding a LIMIT without a sort in
+between, since those stop after a page of rows. Sorted page scenarios also
+fail when no statement orders by their sort column, since an ignored sort
+would otherwise only show the plan of the default order. Exits non-zero on
+any failure, printing the statement and its plan.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+logger = logging.getLogger('benchmarks')
+
+DEFAULT_DB = os.path.join(ROOT, 'instance', 'plans.db')
+EXPORT_TOKEN = 'query-plans'
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(?: USING (COVERING )?INDEX \w+)?$')
+# Postgres nodes that consume their whole input before emitting a row, so a LIMIT above them stops nothing
+BLOCKING_NODES = {'Sort', 'Incremental Sort', 'Aggregate', 'Hash', 'Materialize', 'SetOp', 'WindowAgg'}
+# Full scans the app makes on purpose, matched against the lowercased statement
+EXPECTED_SCANS = ()
+# Leading ORDER BY of each /shop sort, checked so a sort the endpoint ignores cannot pass unnoticed
+NAME_ASC = 'products.product_name'
+PRICE_ASC = 'products.selling_price'
+PRICE_DESC = 'products.selling_price desc'
+ORDER_BY_RE = re.compile(r'\border by\s+([\w.]+)(\s+desc\b)?')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-uri', help="Database to check (default: a SQLite file under instance/)")
+    parser.add_argument('--reset', action='store_true', help="Allow dropping and rebuilding a non-SQLite database")
+    parser.add_argument('--reuse', action='store_true', help="Skip rebuilding the dataset")
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--max-scan-rows', type=int, default=1000, help="Largest table a plan may scan sequentially")
+    parser.add_argument('--scenario', action='append', help="Only run these scenarios (repeatable)")
+    return parser.parse_args()
+
+
+def load_app(args):
+    from benchmarks.run import load_app as load_benchmark_app
+    os.environ.setdefault('ORDER_EXPORT_TOKEN', EXPORT_TOKEN)
+    if not args.database_uri:
+        args.database_uri = f"sqlite:///{DEFAULT_DB}"
+    return load_benchmark_app(args)
+
+
+def _get(path, follow_cursor=False, order_by=None):
+    """A page scenario; with `follow_cursor` the page's last "next" link is requested too.
+
+    `order_by` is the sort key (one of NAME_ASC, PRICE_ASC, PRICE_DESC) some statement must lead with.
+    """
+    from benchmarks.run import CURSOR_RE
+
+    def run(client):
+        body = client.get(path, headers={'Authorization': f'Bearer {EXPORT_TOKEN}'}).get_data(as_text=True)
+        if follow_cursor:
+            cursors = CURSOR_RE.findall(body)
+            if cursors:
+                separator = '&' if '?' in path else '?'
+                client.get(f"{path}{separator}cursor={cursors[-1]}").get_data()
+    run.order_by = order_by
+    return run
+
+
+def _leading_orders(statements):
+    """Return the first ORDER BY key of each statement as `column` or `column desc`, lowercased and unquoted."""
+    return {
+        match.group(1) + (' desc' if match.group(2) else '')
+        for statement in statements
+        for match in ORDER_BY_RE.finditer(statement.lower().replace('"', ''))
+    }
+
+
+def _job(name):
+    def run(client):
+        if name == 'rollups':
+            from rollups import sales_rollups
+            sales_rollups.refresh()
+        elif name == 'recommendations':
+            from recommendations import recommendations
+            recommendations.refresh()
+    return run
+
+
+def scenarios():
+    month_ago = (date.today() - timedelta(days=30)).isoformat()
+    week_ago = (date.today() - timedelta(days=7)).isoformat()
+    today = date.today().isoformat()
+    return {
+        'index': _get('/'),
+        'shop': _get('/shop', True),
+        'shop_category': _get('/shop?category=devices', True),
+        'shop_category_price_sort': _get('/shop?category=devices&sort=price-asc', True, PRICE_ASC),
+        'shop_category_name_sort': _get('/shop?category=lamps&sort=name-asc', True, NAME_ASC),
+        'shop_category_price_filter': _get('/shop?category=shoes&price=0-5000&sort=price-desc', True, PRICE_DESC),
+        'shop_price_filter': _get('/shop?price=5000-20000', True),
+        'shop_price_sort': _get('/shop?sort=price-desc&price=1000-30000', True, PRICE_DESC),
+        'shop_name_sort': _get('/shop?sort=name-asc', True, NAME_ASC),
+        'products_page': _get('/products?limit=20'),
+        'recommendations': _get('/products/1/recommendations'),
+        'rollups_refresh': _job('rollups'),
+        'recommendations_refresh': _job('recommendations'),
+        'analytics_products': _get(f'/analytics/products?start={month_ago}&by=day'),
+        'analytics_categories': _get('/analytics/categories'),
+        'analytics_payments': _get('/analytics/payments'),
+        'export_date_range': _get(f'/orders/export?start={week_ago}&end={today}'),
+        'export_customer': _get('/orders/export?customer_id=42'),
+    }
+
+
+class Explainer:
+    """Runs EXPLAIN for captured statements and reports sequential scans of large tables."""
+
+    def __init__(self, engine, max_scan_rows):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self.max_scan_rows = max_scan_rows
+        self._rows = {}
+
+    def table_rows(self, connection, table):
+        if table not in self._rows:
+            from sqlalchemy import inspect
+            if table in inspect(connection).get_table_names():
+                self._rows[table] = connection.exec_driver_sql(f'SELECT count(*) FROM "{table}"').scalar()
+            else:
+                self._rows[table] = 0  # A subquery or CTE name, not a table
+        return self._rows[table]
+
+    def check(self, statement, parameters):
+        """Return (plan text, [problem]) for one statement."""
+        with self.engine.connect() as connection:
+            if self.dialect == 'postgresql':
+                plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+                plan = plan if isinstance(plan, list) else json.loads(plan)
+                scans = list(self._pg_scans(plan[0]['Plan'], limited=False))
+                text = json.dumps(plan)
+            elif self.dialect == 'sqlite':
+                rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+                details = [row[-1] for row in rows]
+                limited = re.search(r'\bLIMIT\b', statement, re.IGNORECASE) is not None \
+                    and not any(detail.startswith('USE TEMP B-TREE') for detail in details)
+                scans = [
+                    (match.group(1), limited)
+                    for match in map(SQLITE_SCAN_RE.match, details)
+                    if match and not match.group(2)
+                ]
+                text = '\n'.join(details)
+            else:
+                raise SystemExit(f"EXPLAIN checks are not implemented for {self.dialect}")
+            problems = [
+                f"sequential scan of {table} ({rows} rows)"
+                for table, limited in scans
+                if not limited and (rows := self.table_rows(connection, table)) > self.max_scan_rows
+            ]
+        return text, problems
+
+    def _pg_scans(self, node, limited):
+        node_type = node['Node Type']
+        if node_type == 'Seq Scan':
+            yield node['Relation Name'], limited
+        if node_type == 'Limit':
+            limited = True
+        elif node_type in BLOCKING_NODES:
+            limited = False
+        for child in node.get('Plans', ()):
+            yield from self._pg_scans(child, limited)
+
+
+def run(app, args):
+    from sqlalchemy import event
+    from db import db
+    from catalog_cache import catalog_cache
+    from fragments import fragment_cache
+
+    selected = scenarios()
+    names = args.scenario or list(selected)
+    unknown = [name for name in names if name not in selected]
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    captured = []
+    failures = 0
+    with app.app_context():
+        explainer = Explainer(db.engine, args.max_scan_rows)
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().split(None, 1)[0].upper() in EXPLAINED:
+                captured.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            client = app.test_client()
+            print(f"{'scenario':<28}{'statements':>12}{'problems':>10}")
+            for name in names:
+                # Start cold so every cached catalog read reaches the database
+                catalog_cache.invalidate()
+                fragment_cache.clear()
+                captured.clear()
+                selected[name](client)
+                statements = dict(captured)  # One EXPLAIN per distinct statement
+                problems = []
+                for statement, parameters in statements.items():
+                    if any(marker in statement.lower() for marker in EXPECTED_SCANS):
+                        continue
+                    plan, found = explainer.check(statement, parameters)
+                    problems.extend((statement, plan, problem) for problem in found)
+                order_by = getattr(selected[name], 'order_by', None)
+                ignored = bool(order_by) and order_by not in _leading_orders(statements)
+                print(f"{name:<28}{len(statements):>12}{len(problems) + ignored:>10}")
+                if ignored:
+                    print(f"  sort ignored: no statement orders by {order_by}")
+                for statement, plan, problem in problems:
+                    print(f"  {problem}\n    {' '.join(statement.split())}\n    plan: {plan.replace(chr(10), ' | ')}")
+                failures += len(problems) + ignored
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+    return failures
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    app = load_app(args)
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    if not args.reuse:
+        from sqlalchemy import text
+        from db import db
+        from benchmarks.dataset import build_dataset
+        with app.app_context():
+            build_dataset(args.products, args.customers, args.orders, args.seed)
+            db.session.execute(text('ANALYZE'))  # Give the planner row statistics, as a live database has
+            db.session.commit()
+
+    failures = run(app, args)
+    if failures:
+        print(f"\n{failures} problems: sequential scans over {args.max_scan_rows} rows or ignored sorts")
+        return 1
+    print(f"\nNo sequential scans over {args.max_scan_rows} rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Concurrent flash-sale check for hot-SKU reservations (inventory.py).
+
+    python benchmarks/reservations.py                          # SQLite file under instance/
+    python benchmarks/reservations.py --database-uri postgresql://... --reset --threads 32
+
+Puts --stock units of one product on sale and lets --threads buyers hold and
+confirm 1-3 units each until it sells out, once against the single
+`products` row and once against --shards counter rows. Each run checks that
+exactly --stock units were sold, that no counter went negative, and that
+after `reconcile()` `products.stock_quantity` is zero. Exits non-zero when
+any check fails.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+logger = logging.getLogger('benchmarks')
+
+DEFAULT_DB = os.path.join(ROOT, 'instance', 'reservations.db')
+PRODUCT_ID = 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-uri', help="Database to run against (default: a SQLite file under instance/)")
+    parser.add_argument('--reset', action='store_true', help="Allow dropping and rebuilding a non-SQLite database")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--stock', type=int, default=2000)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def load_app(args):
+    uri = args.database_uri or f"sqlite:///{DEFAULT_DB}"
+    if uri.startswith('sqlite:///'):
+        os.makedirs(os.path.dirname(uri[len('sqlite:///'):]) or '.', exist_ok=True)
+    elif not args.reset:
+        sys.exit("Refusing to rebuild a non-SQLite database without --reset")
+    os.environ['DATABASE_URI'] = uri
+    os.environ.setdefault('DB_POOL_SIZE', str(args.threads))
+    os.chdir(ROOT)
+    import main
+    return main.create_app()
+
+
+def reset(app, stock, shards):
+    from db import db, Products
+    from inventory import inventory
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(Products(product_id=PRODUCT_ID, product_name='Flash Sale Item', buying_price=80,
+                                selling_price=100, stock_quantity=stock, category='devices'))
+        db.session.commit()
+        if shards:
+            inventory.shard(PRODUCT_ID, shards)
+            db.session.commit()
+
+
+def buyer(app, rng, sold, failures, lock):
+    from sqlalchemy import update
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm import undefer
+    from db import db, Products
+    from inventory import inventory
+    with app.app_context():
+        sharded = db.session.get(Products, PRODUCT_ID, options=[undefer(Products.is_sharded)]).is_sharded
+        db.session.rollback()
+        while True:
+            quantity = rng.randint(1, 3)
+            try:
+                if sharded:
+                    owner = uuid.uuid4().hex
+                    ok = inventory.hold(owner, PRODUCT_ID, quantity)
+                    if ok:
+                        db.session.commit()  # Cart step
+                        ok = inventory.confirm(owner, PRODUCT_ID, quantity, None)
+                else:
+                    ok = db.session.execute(
+                        update(Products)
+                        .where(Products.product_id == PRODUCT_ID, Products.stock_quantity >= quantity)
+                        .values(stock_quantity=Products.stock_quantity - quantity)
+                        .execution_options(synchronize_session=False)
+                    ).rowcount == 1
+                db.session.commit()
+            except OperationalError:
+                # SQLite "database is locked" under write contention; retry like a client would
+                db.session.rollback()
+                with lock:
+                    failures[0] += 1
+                continue
+            if ok:
+                with lock:
+                    sold[0] += quantity
+            elif quantity == 1:
+                return
+
+
+def run(app, args, shards):
+    from sqlalchemy import func, select
+    from db import db, Products, StockShards, StockReservations
+    from inventory import inventory, CONFIRMED
+    reset(app, args.stock, shards)
+    sold, failures, lock = [0], [0], threading.Lock()
+    threads = [
+        threading.Thread(target=buyer, args=(app, random.Random(args.seed + i), sold, failures, lock))
+        for i in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    problems = []
+    with app.app_context():
+        if shards:
+            inventory.reconcile()
+            confirmed = db.session.scalar(
+                select(func.coalesce(func.sum(StockReservations.quantity), 0)).where(StockReservations.status == CONFIRMED))
+            if confirmed != sold[0]:
+                problems.append(f"confirmed reservations ({confirmed}) != units sold ({sold[0]})")
+            if db.session.scalar(select(func.count()).where(StockShards.quantity < 0)):
+                problems.append("a stock shard went negative")
+        remaining = db.session.scalar(select(Products.stock_quantity).where(Products.product_id == PRODUCT_ID))
+    if sold[0] != args.stock or remaining != 0:
+        problems.append(f"sold {sold[0]} of {args.stock} units, {remaining} left in products.stock_quantity")
+    label = f"{shards} shards" if shards else "single row"
+    print(f"{label:<12} {sold[0]:>7} units  {elapsed:>7.2f}s  {sold[0] / elapsed:>9.1f} units/s  {failures[0]:>5} retries"
+          f"  {'OK' if not problems else 'FAILED'}")
+    for problem in problems:
+        print(f"  {problem}")
+    return not problems
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    app = load_app(args)
+    logging.getLogger().setLevel(logging.WARNING)
+    ok = run(app, args, 0)
+    ok = run(app, args, args.shards) and ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
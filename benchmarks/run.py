@@ -0,0 +1,387 @@
+"""Storefront benchmark: latency, throughput and queries per request for the main routes.
+
+    python benchmarks/run.py                       # build a SQLite dataset, run, compare to baseline.json
+    python benchmarks/run.py --save-baseline       # record the current numbers as the baseline
+    python benchmarks/run.py --mode http --workers 8 --duration 20
+    python benchmarks/run.py --database-uri postgresql://... --reset
+
+`client` mode drives each scenario sequentially through the Flask test client
+and counts SQL statements per request. `http` mode serves the app from a
+threaded in-process server and hits it from --workers keep-alive connections
+for --duration seconds. The run exits non-zero when a scenario errors, its
+p95 exceeds the baseline by more than --tolerance, or it issues more queries
+per request than the baseline. Latency baselines are machine-specific:
+record one on the machine that runs the comparison.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+logger = logging.getLogger('benchmarks')
+
+DEFAULT_DB = os.path.join(ROOT, 'instance', 'bench.db')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SEARCH_TERMS = ('blue', 'camera', 'smart wat', 'leather bag', 'vintage lamp', 'robot')
+CURSOR_RE = re.compile(r'[?&]cursor=([\w-]+)')
+MIN_SAMPLES = 20  # Fewer timed requests than this are too noisy to compare p95 against
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-uri', help="Database to benchmark (default: a SQLite file under instance/)")
+    parser.add_argument('--reset', action='store_true', help="Allow dropping and rebuilding a non-SQLite database")
+    parser.add_argument('--reuse', action='store_true', help="Skip rebuilding the dataset")
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mode', choices=('client', 'http', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=50, help="Timed requests per scenario in client mode")
+    parser.add_argument('--warmup', type=int, default=5, help="Untimed requests per scenario before measuring")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent connections in http mode")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds of load in http mode")
+    parser.add_argument('--scenario', action='append', help="Only run these scenarios (repeatable)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p95 slowdown over the baseline (0.25 = 25%%)")
+    parser.add_argument('--output', help="Also write the results JSON here")
+    return parser.parse_args()
+
+
+def load_app(args):
+    uri = args.database_uri or f"sqlite:///{DEFAULT_DB}"
+    if uri.startswith('sqlite:///'):
+        os.makedirs(os.path.dirname(uri[len('sqlite:///'):]) or '.', exist_ok=True)
+    elif not args.reuse and not args.reset:
+        sys.exit("Refusing to rebuild a non-SQLite database without --reset")
+    os.environ['DATABASE_URI'] = uri
+    os.environ.setdefault('ROLLUP_REFRESH_INTERVAL', '0')
+    os.chdir(ROOT)
+
+    import main
+    from flask import render_template
+    app = main.create_app()
+    app.config['WTF_CSRF_ENABLED'] = False  # Scenarios send the session token in the JSON body instead
+    if 'contact' not in app.view_functions:
+        # Storefront templates link to url_for('contact'), which main.py does not define yet
+        app.add_url_rule('/contact', 'contact', lambda: render_template('contact.html'))
+    return app
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, queries=None, elapsed=None):
+    values = sorted(latencies)
+    result = {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(percentile(values, 50) * 1000, 3) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 3) if values else None,
+        'p99_ms': round(percentile(values, 99) * 1000, 3) if values else None,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else None
+    }
+    if queries is not None:
+        result['queries_per_request'] = round(sum(queries) / len(queries), 2) if queries else 0
+    return result
+
+
+class ClientSession:
+    """A shopper session on the Flask test client."""
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+        self.client.get('/cart/summary')
+
+    def csrf_token(self):
+        with self.client.session_transaction() as session:
+            return session.get('csrf_token')
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, data
+
+
+class HttpSession:
+    """A shopper session on one keep-alive HTTP connection, carrying the session cookie."""
+
+    def __init__(self, app, host, port):
+        self.app = app
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+        self.cookie = None
+        self.request('GET', '/cart/summary')
+
+    def csrf_token(self):
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        return serializer.loads(self.cookie.split('=', 1)[1]).get('csrf_token') if self.cookie else None
+
+    def request(self, method, path, body=None):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        self.connection.request(method, path, body=payload, headers=headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status, data
+
+
+class Context:
+    """Shared inputs for scenarios: known product ids, categories and a deep /shop cursor."""
+
+    def __init__(self, app, seed):
+        from db import Products
+        from benchmarks.dataset import CATEGORIES
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.categories = CATEGORIES
+        with app.app_context():
+            self.product_ids = [pid for (pid,) in Products.query.with_entities(Products.product_id).all()]
+        per_page = app.config['PER_PAGE']
+        self.deep_page = max(1, len(self.product_ids) // per_page - 1)
+        self.deep_cursor = self._walk_cursor(app, min(self.deep_page, 50))
+
+    @staticmethod
+    def _walk_cursor(app, pages):
+        # Follow "next" links from the first /shop page to reach a cursor deep in the catalog
+        client = app.test_client()
+        cursor = None
+        for _ in range(pages):
+            body = client.get('/shop' + (f'?cursor={cursor}' if cursor else '')).get_data(as_text=True)
+            match = None
+            for match in CURSOR_RE.finditer(body):
+                pass
+            if match is None:
+                break
+            cursor = match.group(1)
+        return cursor
+
+    def choice(self, values):
+        with self.lock:
+            return self.rng.choice(values)
+
+    def product(self):
+        return self.choice(self.product_ids)
+
+
+def _add_to_cart(session, ctx, count=2):
+    for _ in range(count):
+        session.request('POST', '/cart', {
+            'action': 'add', 'product_id': ctx.product(), 'quantity': 1, 'csrf_token': session.csrf_token()
+        })
+
+
+def _checkout_body(session, ctx):
+    n = ctx.product()
+    return {
+        'csrf_token': session.csrf_token(),
+        'billing-first-name': 'Bench', 'billing-last-name': f'User{n}', 'billing-email': f'bench{n}@example.com',
+        'billing-mobile': '0700000000', 'billing-address1': '1 Load St', 'billing-country': 'Kenya',
+        'billing-city': 'Nairobi', 'billing-state': 'Nairobi', 'billing-zip': '00100',
+        'payment': 'mpesa', 'shipping': 0
+    }
+
+
+# name -> (prepare(session, ctx) or None, build(session, ctx) -> (method, path, body))
+SCENARIOS = {
+    'index': (None, lambda s, c: ('GET', '/', None)),
+    'products_page': (None, lambda s, c: ('GET', '/products?limit=20', None)),
+    'products_stream': (None, lambda s, c: ('GET', '/products', None)),
+    'shop': (None, lambda s, c: ('GET', '/shop', None)),
+    'shop_category': (None, lambda s, c: ('GET', f'/shop?category={c.choice(c.categories)}', None)),
+    'shop_price_sort': (None, lambda s, c: ('GET', '/shop?sort=price-desc&price=1000-30000', None)),
+    'shop_search': (None, lambda s, c: ('GET', f'/shop?search={c.choice(SEARCH_TERMS).replace(" ", "+")}', None)),
+    'shop_deep_keyset': (None, lambda s, c: ('GET', f'/shop?cursor={c.deep_cursor}' if c.deep_cursor else '/shop', None)),
+    'shop_deep_offset': (None, lambda s, c: ('GET', f'/shop?page={c.deep_page}', None)),
+    'cart_add': (None, lambda s, c: ('POST', '/cart', {
+        'action': 'add', 'product_id': c.product(), 'quantity': 1, 'csrf_token': s.csrf_token()})),
+    'cart_batch': (None, lambda s, c: ('POST', '/cart/batch', {'csrf_token': s.csrf_token(), 'operations': [
+        {'action': 'add', 'product_id': c.product(), 'quantity': 1} for _ in range(5)]})),
+    'cart_summary': (_add_to_cart, lambda s, c: ('GET', '/cart/summary?items=1', None)),
+    'coupon': (None, lambda s, c: ('POST', '/coupon', {'code': 'BENCH10', 'csrf_token': s.csrf_token()})),
+    'checkout': (_add_to_cart, lambda s, c: ('POST', '/checkout', _checkout_body(s, c))),
+}
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def run_client(app, ctx, names, args):
+    from db import db
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+    results = {}
+    for name in names:
+        prepare, build = SCENARIOS[name]
+        session = ClientSession(app)
+        latencies, queries, errors = [], [], 0
+        for i in range(args.warmup + args.requests):
+            if prepare:
+                prepare(session, ctx)
+            method, path, body = build(session, ctx)
+            before = counter.count
+            started = time.perf_counter()
+            status, _ = session.request(method, path, body)
+            elapsed = time.perf_counter() - started
+            if i < args.warmup:
+                continue
+            latencies.append(elapsed)
+            queries.append(counter.count - before)
+            errors += status >= 400
+        results[name] = summarize(latencies, errors, queries, sum(latencies))
+        logger.info(f"client {name}: {results[name]}")
+    return results
+
+
+def run_http(app, ctx, names, args):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(worker_id):
+        session = HttpSession(app, host, port)
+        rng = random.Random(args.seed + worker_id)
+        while time.perf_counter() < deadline:
+            name = rng.choice(names)
+            prepare, build = SCENARIOS[name]
+            if prepare:
+                prepare(session, ctx)
+            method, path, body = build(session, ctx)
+            started = time.perf_counter()
+            status, _ = session.request(method, path, body)
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples[name].append(elapsed)
+                errors[name] += status >= 400
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            list(pool.map(worker, range(args.workers)))
+    finally:
+        server.shutdown()
+    elapsed = time.perf_counter() - started
+
+    results = {name: summarize(samples[name], errors[name], elapsed=elapsed) for name in names}
+    total = sum(len(v) for v in samples.values())
+    results['_all'] = summarize([x for v in samples.values() for x in v], sum(errors.values()), elapsed=elapsed)
+    logger.info(f"http: {total} requests from {args.workers} workers in {elapsed:.1f}s")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression messages (empty when the run passes)."""
+    problems = []
+    for mode, scenarios in results.items():
+        for name, current in scenarios.items():
+            if current['errors']:
+                problems.append(f"{mode}/{name}: {current['errors']} failed requests")
+            previous = baseline.get(mode, {}).get(name)
+            if not previous:
+                continue
+            if current['requests'] >= MIN_SAMPLES and previous.get('p95_ms') \
+                    and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                problems.append(f"{mode}/{name}: p95 {current['p95_ms']}ms vs baseline {previous['p95_ms']}ms")
+            if 'queries_per_request' in previous and current.get('queries_per_request', 0) > previous['queries_per_request'] + 0.01:
+                problems.append(f"{mode}/{name}: {current['queries_per_request']} queries/request vs baseline {previous['queries_per_request']}")
+    return problems
+
+
+def print_table(results):
+    columns = ('requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request')
+    for mode, scenarios in results.items():
+        print(f"\n[{mode}]")
+        print(f"{'scenario':<18}" + ''.join(f"{c:>20}" for c in columns))
+        for name, row in scenarios.items():
+            print(f"{name:<18}" + ''.join(f"{'' if row.get(c) is None else row.get(c):>20}" for c in columns))
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    app = load_app(args)
+    # Keep the app's and the server's per-request logging out of the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    if not args.reuse:
+        from benchmarks.dataset import build_dataset
+        with app.app_context():
+            build_dataset(args.products, args.customers, args.orders, args.seed)
+
+    names = args.scenario or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(unknown)}")
+    ctx = Context(app, args.seed)
+
+    results = {}
+    if args.mode in ('client', 'both'):
+        results['client'] = run_client(app, ctx, names, args)
+    if args.mode in ('http', 'both'):
+        results['http'] = run_http(app, ctx, names, args)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+    with open(args.baseline) as file:
+        problems = compare(results, json.load(file), args.tolerance)
+    if problems:
+        print("\nRegressions against the baseline:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Cold-start benchmark: how long a fresh worker process takes to import and build the app.
+
+    python benchmarks/startup.py                     # 10 fresh interpreters against a SQLite URI
+    python benchmarks/startup.py --runs 30 --database-uri postgresql://...
+
+Each run starts a new Python interpreter, times `import main` and
+`main.create_app()` separately, and records how many database connections
+were opened and how many threads were running afterwards. Building the app
+must open no connection and start no thread, or it is not safe to preload
+before forking workers; the run exits non-zero if it does either.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in each fresh interpreter; prints one JSON line of measurements
+PROBE = """
+import json, threading, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+connections = []
+event.listen(Engine, 'connect', lambda *args: connections.append(1))
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.create_app()
+built = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (built - imported) * 1000,
+    'connections': len(connections),
+    'threads': threading.active_count()
+}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-uri', help="DATABASE_URI for the probes (default: a SQLite file under instance/)")
+    parser.add_argument('--runs', type=int, default=10)
+    return parser.parse_args()
+
+
+def probe(env):
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    env = dict(os.environ, DATABASE_URI=args.database_uri or f"sqlite:///{os.path.join(ROOT, 'instance', 'startup.db')}")
+    runs = [probe(env) for _ in range(args.runs)]
+
+    print(f"{'':<16}{'median':>10}{'min':>10}{'max':>10}")
+    for key in ('import_ms', 'create_app_ms'):
+        values = [run[key] for run in runs]
+        print(f"{key:<16}{statistics.median(values):>10.1f}{min(values):>10.1f}{max(values):>10.1f}")
+    connections = max(run['connections'] for run in runs)
+    threads = max(run['threads'] for run in runs)
+    print(f"connections opened: {connections}, threads running: {threads}")
+    if connections or threads > 1:
+        print("Startup is not fork-safe: building the app must not connect to the database or start threads")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app, g, session
+from db import db, CartItems
+
+logger = logging.getLogger(__name__)
+
+
+class BatchAborted(Exception):
+    """Raise inside `CartStore.batch()` to undo every change the batch made."""
+
+
+def line_key(product_id, size=None, color=None):
+    """Key identifying one cart line: the same product in another size/color is a separate line."""
+    return (int(product_id), size or '', color or '')
+
+
+class MemoryCartBackend:
+    """Process-local cart storage, for tests and single-process development."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def items(self, cart_id):
+        with self._lock:
+            return [dict(item) for item in self._carts.get(cart_id, {}).values()]
+
+    def get(self, cart_id, key):
+        with self._lock:
+            item = self._carts.get(cart_id, {}).get(key)
+            return dict(item) if item else None
+
+    def put(self, cart_id, key, item):
+        with self._lock:
+            self._carts.setdefault(cart_id, OrderedDict())[key] = dict(item)
+
+    def remove(self, cart_id, key):
+        with self._lock:
+            self._carts.get(cart_id, {}).pop(key, None)
+
+    def clear(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+    def purge(self, older_than):
+        return 0
+
+    def savepoint(self, cart_id):
+        """Copy the cart, for `rollback` to put back."""
+        with self._lock:
+            cart = self._carts.get(cart_id)
+            return cart_id, OrderedDict((key, dict(item)) for key, item in cart.items()) if cart is not None else None
+
+    def rollback(self, savepoint):
+        cart_id, cart = savepoint
+        with self._lock:
+            if cart is None:
+                self._carts.pop(cart_id, None)
+            else:
+                self._carts[cart_id] = cart
+
+    def commit(self):
+        pass
+
+
+class DatabaseCartBackend:
+    """Cart lines stored in the `cart_items` table, one row per (cart, product, size, color)."""
+
+    name = 'database'
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            'product_id': row.product_id,
+            'name': row.name,
+            'price': float(row.price),
+            'image': row.image,
+            'quantity': row.quantity,
+            'size': row.size or None,
+            'color': row.color or None
+        }
+
+    def _row(self, cart_id, key):
+        product_id, size, color = key
+        return CartItems.query.filter_by(cart_id=cart_id, product_id=product_id, size=size, color=color).first()
+
+    def items(self, cart_id):
+        rows = CartItems.query.filter_by(cart_id=cart_id).order_by(CartItems.id).all()
+        return [self._to_dict(row) for row in rows]
+
+    def get(self, cart_id, key):
+        row = self._row(cart_id, key)
+        return self._to_dict(row) if row else None
+
+    def put(self, cart_id, key, item):
+        row = self._row(cart_id, key)
+        if row is None:
+            product_id, size, color = key
+            row = CartItems(cart_id=cart_id, product_id=product_id, size=size, color=color)
+            db.session.add(row)
+        row.quantity = item['quantity']
+        row.price = item['price']
+        row.name = item.get('name')
+        row.image = item.get('image')
+
+    def remove(self, cart_id, key):
+        product_id, size, color = key
+        CartItems.query.filter_by(cart_id=cart_id, product_id=product_id, size=size, color=color).delete()
+
+    def clear(self, cart_id):
+        CartItems.query.filter_by(cart_id=cart_id).delete()
+
+    def purge(self, older_than):
+        deleted = CartItems.query.filter(CartItems.updated_at < older_than).delete()
+        db.session.commit()
+        return deleted
+
+    def savepoint(self, cart_id):
+        return None  # Uncommitted rows are undone by rolling back the session
+
+    def rollback(self, savepoint):
+        db.session.rollback()
+
+    def commit(self):
+        db.session.commit()
+
+
+class CartStore:
+    """Server-side carts keyed by an id kept in the Flask session.
+
+    The session cookie only carries `cart_id`; lines live in the configured
+    backend and are addressed directly by `line_key`, so add/update/remove
+    never scan the cart.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CART_STORE", "database")
+        app.config.setdefault("CART_TTL_DAYS", 30)
+        backend = app.extensions['cart_store'] = (
+            MemoryCartBackend() if app.config["CART_STORE"] == "memory" else DatabaseCartBackend()
+        )
+
+        @app.cli.command('purge-carts')
+        def purge_carts():
+            """Delete cart lines untouched for longer than CART_TTL_DAYS."""
+            deleted = backend.purge(datetime.utcnow() - timedelta(days=int(app.config["CART_TTL_DAYS"])))
+            logger.info(f"Purged {deleted} abandoned cart lines")
+
+    @property
+    def backend(self):
+        """The current app's cart backend."""
+        return current_app.extensions['cart_store']
+
+    def cart_id(self, create=False):
+        """Return the current session's cart id, creating one if asked."""
+        cart_id = session.get('cart_id')
+        legacy = session.pop('cart') if 'cart' in session else None
+        if cart_id is None and (create or legacy):
+            cart_id = session['cart_id'] = uuid.uuid4().hex
+        if legacy:
+            # Carry over a cart from the old cookie-based session format
+            for item in legacy:
+                self.backend.put(cart_id, line_key(item['product_id'], item.get('size'), item.get('color')), item)
+            self._commit()
+        return cart_id
+
+    def _commit(self):
+        if not g.get('cart_batch'):
+            self.backend.commit()
+
+    @contextmanager
+    def batch(self):
+        """Group several mutations in this request into a single backend commit.
+
+        If the block raises (`BatchAborted` to fail it deliberately), the cart
+        is put back as it was when the outermost batch began.
+        """
+        if g.get('cart_batch'):
+            yield self
+            return
+        backend = self.backend
+        savepoint = backend.savepoint(self.cart_id(create=True))
+        g.cart_batch = True
+        try:
+            yield self
+        except BaseException:
+            backend.rollback(savepoint)
+            raise
+        finally:
+            g.cart_batch = False
+        backend.commit()
+
+    def items(self):
+        cart_id = self.cart_id()
+        return self.backend.items(cart_id) if cart_id else []
+
+    def get(self, product_id, size=None, color=None):
+        cart_id = self.cart_id()
+        return self.backend.get(cart_id, line_key(product_id, size, color)) if cart_id else None
+
+    def put(self, item):
+        """Insert or replace the line identified by the item's product/size/color."""
+        cart_id = self.cart_id(create=True)
+        self.backend.put(cart_id, line_key(item['product_id'], item.get('size'), item.get('color')), item)
+        self._commit()
+
+    def remove(self, product_id, size=None, color=None):
+        cart_id = self.cart_id()
+        if cart_id:
+            self.backend.remove(cart_id, line_key(product_id, size, color))
+            self._commit()
+
+    def clear(self):
+        cart_id = self.cart_id()
+        if cart_id:
+            self.backend.clear(cart_id)
+            self._commit()
+
+
+cart_store = CartStore()
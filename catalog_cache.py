@@ -0,0 +1,298 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.orm import Session
+from db import db, CatalogVersions, Products
+
+logger = logging.getLogger(__name__)
+
+# Columns needed to render a product card; rows are plain tuples so they are safe
+# to share between requests (unlike ORM instances bound to a session).
+CARD_COLUMNS = (
+    Products.product_id,
+    Products.product_name,
+    Products.selling_price,
+    Products.image,
+    Products.category,
+    Products.rating,
+    Products.description,
+)
+
+# Names of the change counters in `catalog_versions`
+CATALOG = 'catalog'
+SEARCH = 'search'
+# Columns the search index is built from
+SEARCH_COLUMNS = frozenset({'product_name', 'category', 'description'})
+# Columns always read fresh, never from the cache: checkouts change them without bumping a version
+LIVE_COLUMNS = frozenset({'stock_quantity'})
+
+
+def touched_versions(columns=None):
+    """Return the version names a change to `columns` of products bumps; None means any column (or a row added or removed)."""
+    if columns is None:
+        return {CATALOG, SEARCH}
+    columns = set(columns)
+    touched = set()
+    if columns - LIVE_COLUMNS:
+        touched.add(CATALOG)
+    if columns & SEARCH_COLUMNS:
+        touched.add(SEARCH)
+    return touched
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=128, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` on a miss."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class _CatalogState:
+    """One app's cached catalog reads and the versions last read for them."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.invalidations = 0
+        self.version_lock = threading.Lock()
+        self.versions = None  # name -> (version, last_modified)
+        self.versions_read_at = 0.0
+
+
+class CatalogCache:
+    """In-process cache for the catalog reads behind the homepage and /products.
+
+    Entries are keyed on the catalog version, a counter in `catalog_versions`
+    bumped by every transaction that changes products (other than their
+    stock). Each process rereads the counters at most every
+    CATALOG_VERSION_TTL seconds, so a change made anywhere is picked up within
+    that; changes committed in this process are seen immediately.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CATALOG_CACHE_TTL", 60)
+        app.config.setdefault("CATALOG_CACHE_SIZE", 128)
+        app.config.setdefault("CATALOG_VERSION_TTL", 1)
+        app.extensions['catalog_cache'] = _CatalogState(TTLCache(
+            maxsize=int(app.config["CATALOG_CACHE_SIZE"]),
+            ttl=float(app.config["CATALOG_CACHE_TTL"])
+        ))
+
+    @property
+    def _state(self):
+        return current_app.extensions['catalog_cache']
+
+    @property
+    def _cache(self):
+        return self._state.cache
+
+    def featured_products(self, limit=8):
+        """Return the first `limit` products as card rows."""
+        return self.get_or_load(
+            ('featured', limit),
+            lambda: db.session.execute(select(*CARD_COLUMNS).limit(limit)).all()
+        )
+
+    def recent_products(self, limit=8):
+        """Return the `limit` newest products as card rows."""
+        return self.get_or_load(
+            ('recent', limit),
+            lambda: db.session.execute(
+                select(*CARD_COLUMNS).order_by(Products.product_id.desc()).limit(limit)
+            ).all()
+        )
+
+    def categories(self):
+        """Return the distinct product categories."""
+        return self.get_or_load(
+            ('categories',),
+            lambda: [c for c in db.session.execute(
+                select(Products.category).distinct().order_by(Products.category)
+            ).scalars() if c]
+        )
+
+    def version(self, name=CATALOG):
+        """Return `(version, last_modified)` of the named change counter.
+
+        Both come from `catalog_versions`, so every process serving the same
+        database agrees on them. `last_modified` is None for a counter that
+        has no row yet.
+        """
+        state = self._state
+        with state.version_lock:
+            versions = state.versions
+            if versions is None or time.monotonic() - state.versions_read_at > float(current_app.config["CATALOG_VERSION_TTL"]):
+                versions = state.versions = {
+                    row.name: (row.version, row.updated_at and row.updated_at.replace(tzinfo=timezone.utc, microsecond=0))
+                    for row in db.session.execute(
+                        select(CatalogVersions.name, CatalogVersions.version, CatalogVersions.updated_at)
+                    )
+                }
+                state.versions_read_at = time.monotonic()
+        return versions.get(name, (0, None))
+
+    def get_or_load(self, key, loader, version=CATALOG):
+        """Cache an arbitrary catalog-derived value under `key`, until the named version changes."""
+        return self._cache.get_or_load((key, self.version(version)[0]), loader)
+
+    def forget_versions(self):
+        """Reread the version counters on next use."""
+        with self._state.version_lock:
+            self._state.versions = None
+
+    def invalidate(self):
+        self._cache.clear()
+        self.forget_versions()
+        self._state.invalidations += 1
+        logger.info("Catalog cache invalidated")
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['invalidations'] = self._state.invalidations
+        return stats
+
+
+catalog_cache = CatalogCache()
+
+
+def note_product_change(session, columns=None):
+    """Record in `session` that its transaction changed `columns` of products (None: rows added, removed or unknown).
+
+    The listeners below do this for ORM flushes and statements; call it for
+    writes they cannot see, such as COPY through the raw connection.
+    """
+    session.info.setdefault('catalog_changes', set()).update(touched_versions(columns))
+
+
+def _touches_products(statement):
+    # ORM statements such as update(Products) target an annotated copy of the table, so compare names
+    table = getattr(statement, 'table', None)
+    return table is not None and table.name == Products.__tablename__
+
+
+def _updated_columns(orm_execute_state):
+    """Return the product columns an UPDATE statement sets, or None when they cannot be told."""
+    statement = orm_execute_state.statement
+    columns = {getattr(key, 'key', key) for key in (statement._values or {})}
+    parameters = orm_execute_state.parameters or {}
+    for row in parameters if isinstance(parameters, (list, tuple)) else (parameters,):
+        columns.update(key for key in row if key != 'product_id')
+    return {column for column in columns if isinstance(column, str)} or None
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_product_changes(session, flush_context):
+    """Record which product columns a flush changed."""
+    for obj in session.new:
+        if isinstance(obj, Products):
+            note_product_change(session)
+    for obj in session.deleted:
+        if isinstance(obj, Products):
+            note_product_change(session)
+    for obj in session.dirty:
+        if isinstance(obj, Products):
+            attrs = inspect(obj).attrs
+            note_product_change(session, {
+                attr.key for attr in inspect(Products).column_attrs if attrs[attr.key].history.has_changes()
+            })
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_product_statements(orm_execute_state):
+    """Record bulk INSERT/UPDATE/DELETE statements against products."""
+    if not _touches_products(orm_execute_state.statement):
+        return
+    if orm_execute_state.is_update:
+        note_product_change(orm_execute_state.session, _updated_columns(orm_execute_state))
+    elif orm_execute_state.is_insert or orm_execute_state.is_delete:
+        note_product_change(orm_execute_state.session)
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_versions(session):
+    """Bump the counters of everything this transaction changed, inside the transaction itself."""
+    session.flush()
+    names = session.info.pop('catalog_changes', None)
+    if names:
+        session.execute(
+            update(CatalogVersions).where(CatalogVersions.name.in_(sorted(names)))
+            .values(version=CatalogVersions.version + 1, updated_at=datetime.utcnow())
+        )
+        session.info['catalog_bumped'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('catalog_bumped', False) and has_app_context():
+        catalog_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('catalog_changes', None)
+    session.info.pop('catalog_bumped', None)
@@ -0,0 +1,299 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from sqlalchemy import insert, select, update
+from db import db, Products
+from db_helpers import UPSERT_DIALECTS
+from catalog_cache import note_product_change
+
+logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = (
+    'product_id', 'product_name', 'buying_price', 'selling_price', 'stock_quantity',
+    'image', 'category', 'rating', 'description'
+)
+# Columns refreshed in place by upsert mode
+UPSERT_COLUMNS = ('buying_price', 'selling_price', 'stock_quantity')
+DEFAULT_STOCK = 100
+BUYING_PRICE_RATIO = Decimal('0.8')  # Assume 80% of selling price
+READ_CHUNK = 64 * 1024
+WHITESPACE_RE = re.compile(r'\s*')
+NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+
+def iter_json_array(file, chunk_size=READ_CHUNK):
+    """Yield the elements of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        position = WHITESPACE_RE.match(buffer, position).end()
+        if position < len(buffer):
+            char = buffer[position]
+            if not started:
+                if char != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+            if char == ']':
+                return
+            if char == ',':
+                position += 1
+                continue
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number cut by the chunk boundary still decodes (`12` of `1234`, `5` of
+                # `5.5`), so an element is only trusted once something else follows it
+                if eof or (end < len(buffer) and buffer[end] not in NUMBER_CHARS):
+                    position = end
+                    yield element
+                    continue
+        if eof:
+            raise ValueError("Unterminated JSON array" if started else "Expected a JSON array")
+        # Keep only the unparsed tail so the buffer stays about one chunk long
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_json_lines(file):
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON on line {number}: {e}")
+
+
+def iter_csv(file):
+    yield from csv.DictReader(file)
+
+
+READERS = {'json': iter_json_array, 'jsonl': iter_json_lines, 'csv': iter_csv}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension == 'ndjson':
+        return 'jsonl'
+    if extension not in READERS:
+        raise ValueError(f"Cannot tell the format of {path}; pass one of {', '.join(READERS)}")
+    return extension
+
+
+def _decimal(value):
+    if value is None or value == '':
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Not a number: {value!r}")
+
+
+def normalize(record):
+    """Map an input record (product.json keys or column names) onto Products columns.
+
+    `stock_quantity` is None when the input does not carry one, so upserts can
+    leave existing stock alone.
+    """
+    product_id = record.get('id', record.get('product_id'))
+    selling_price = _decimal(record.get('price', record.get('selling_price')))
+    if product_id in (None, '') or selling_price is None:
+        raise ValueError(f"Record needs an id and a price: {record!r}")
+    buying_price = _decimal(record.get('buying_price'))
+    return {
+        'product_id': int(product_id),
+        'product_name': record.get('name', record.get('product_name')),
+        'buying_price': buying_price if buying_price is not None else selling_price * BUYING_PRICE_RATIO,
+        'selling_price': selling_price,
+        'stock_quantity': _decimal(record.get('stock', record.get('stock_quantity'))),
+        'image': record.get('image') or None,
+        'category': record.get('category') or None,
+        'rating': _decimal(record.get('rating')),
+        'description': record.get('description') or None
+    }
+
+
+def batches(records, size):
+    iterator = iter(records)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.read} rows read, {self.inserted} inserted, {self.updated} updated, "
+                f"{self.skipped} skipped in {self.elapsed:.1f}s ({self.rate:.0f} rows/sec)")
+
+
+def _with_default_stock(rows):
+    return [dict(row, stock_quantity=DEFAULT_STOCK if row['stock_quantity'] is None else row['stock_quantity']) for row in rows]
+
+
+def _write_batch_upsert_statement(insert_fn, rows, upsert):
+    """Multi-row INSERT ... ON CONFLICT for Postgres/SQLite; returns (inserted, updated)."""
+    # Executed with a parameter list, SQLAlchemy compiles the statement once and
+    # sends the batch as multi-row VALUES ("insertmanyvalues")
+    table = Products.__table__
+    if not upsert:
+        stmt = insert_fn(table).on_conflict_do_nothing(
+            index_elements=[table.c.product_id]
+        ).returning(table.c.product_id)
+        return len(db.session.execute(stmt, _with_default_stock(rows)).all()), 0
+
+    existing = set(db.session.scalars(
+        select(Products.product_id).where(Products.product_id.in_([row['product_id'] for row in rows]))
+    ))
+    # Rows without a stock figure keep the stock they already have
+    for has_stock in (True, False):
+        group = [row for row in rows if (row['stock_quantity'] is not None) == has_stock]
+        if not group:
+            continue
+        stmt = insert_fn(table)
+        columns = UPSERT_COLUMNS if has_stock else tuple(c for c in UPSERT_COLUMNS if c != 'stock_quantity')
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id],
+            set_={column: stmt.excluded[column] for column in columns}
+        )
+        db.session.execute(stmt, _with_default_stock(group))
+    updated = sum(1 for row in rows if row['product_id'] in existing)
+    return len(rows) - updated, updated
+
+
+def _write_batch_portable(rows, upsert):
+    """Batch existence check plus executemany, for databases without ON CONFLICT."""
+    existing = set(db.session.scalars(
+        select(Products.product_id).where(Products.product_id.in_([row['product_id'] for row in rows]))
+    ))
+    new_rows = [row for row in rows if row['product_id'] not in existing]
+    if new_rows:
+        db.session.execute(insert(Products), _with_default_stock(new_rows))
+    updates = [
+        {'product_id': row['product_id'], **{c: row[c] for c in UPSERT_COLUMNS if row[c] is not None}}
+        for row in rows if upsert and row['product_id'] in existing
+    ]
+    if updates:
+        # ORM bulk UPDATE by primary key: one executemany per distinct set of columns
+        db.session.execute(update(Products), updates)
+    return len(new_rows), len(updates)
+
+
+def _write_batch_copy(rows, upsert):
+    """COPY the batch into a temporary staging table, then merge it into products."""
+    connection = db.session.connection()
+    column_list = ', '.join(IMPORT_COLUMNS)
+    connection.exec_driver_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS products_import "
+        "(LIKE products INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    )
+    connection.exec_driver_sql("ALTER TABLE products_import ALTER COLUMN stock_quantity DROP NOT NULL")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[column] is None else row[column] for column in IMPORT_COLUMNS])
+    buffer.seek(0)
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY products_import ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    select_list = ', '.join(
+        f'COALESCE(stock_quantity, {DEFAULT_STOCK})' if column == 'stock_quantity' else column
+        for column in IMPORT_COLUMNS
+    )
+    updated = 0
+    if upsert:
+        # Rows without a stock figure keep the stock they already have
+        updated = connection.exec_driver_sql(
+            "UPDATE products p SET buying_price = s.buying_price, selling_price = s.selling_price, "
+            "stock_quantity = COALESCE(s.stock_quantity, p.stock_quantity) "
+            "FROM products_import s WHERE p.product_id = s.product_id"
+        ).rowcount
+    inserted = connection.exec_driver_sql(
+        f"INSERT INTO products ({column_list}) SELECT {select_list} FROM products_import "
+        f"ON CONFLICT (product_id) DO NOTHING"
+    ).rowcount
+    # Written through the raw connection, out of sight of the catalog cache's session listeners
+    if updated:
+        note_product_change(db.session, UPSERT_COLUMNS)
+    if inserted:
+        note_product_change(db.session)
+    return inserted, updated
+
+
+def import_products(path, fmt=None, batch_size=1000, upsert=False, use_copy=False, progress_every=10000):
+    """Stream products from `path` into the Products table, committing once per batch.
+
+    `fmt` is 'json' (a top-level array), 'jsonl' or 'csv'; it defaults to the
+    file extension. Existing products are skipped, or with `upsert` have their
+    prices (and stock, when the input has it) updated in place.
+    """
+    fmt = fmt or detect_format(path)
+    dialect = db.session.get_bind().dialect.name
+    if use_copy and dialect != 'postgresql':
+        raise ValueError("COPY is only available on PostgreSQL")
+    insert_fn = UPSERT_DIALECTS.get(dialect)
+    stats = ImportStats()
+    next_report = progress_every
+
+    with open(path, 'r', newline='' if fmt == 'csv' else None, encoding='utf-8') as file:
+        for batch in batches(READERS[fmt](file), batch_size):
+            rows = {}
+            for record in batch:
+                row = normalize(record)
+                rows[row['product_id']] = row  # Last occurrence wins within a batch
+            rows = list(rows.values())
+            try:
+                if use_copy:
+                    inserted, updated = _write_batch_copy(rows, upsert)
+                elif insert_fn is not None:
+                    inserted, updated = _write_batch_upsert_statement(insert_fn, rows, upsert)
+                else:
+                    inserted, updated = _write_batch_portable(rows, upsert)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.error(f"Import failed after {stats}")
+                raise
+            stats.read += len(batch)
+            stats.inserted += inserted
+            stats.updated += updated
+            stats.skipped += len(batch) - inserted - updated
+            if progress_every and stats.read >= next_report:
+                logger.info(f"Imported {stats}")
+                next_report += progress_every
+
+    logger.info(f"Import finished: {stats}")
+    return stats
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from itertools import chain
+from flask import current_app, has_app_context, request
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from db import db, Coupons
+from catalog_cache import TTLCache
+from cart_store import cart_store
+
+logger = logging.getLogger(__name__)
+
+
+class _CouponTable:
+    """One app's cached coupons: the whole table, or per-code results once it grows too large."""
+
+    def __init__(self, ttl, table_max, codes, attempts):
+        self.ttl = ttl
+        self.table_max = table_max
+        self.codes = codes
+        self.attempts = attempts  # ('ip' | 'cart', id) -> (failed attempts, window start)
+        self.table = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+        self.table_hits = 0
+        self.reloads = 0
+
+
+class CouponCache:
+    """Serves coupon lookups from memory.
+
+    While the coupons table has at most COUPON_TABLE_MAX rows it is held whole
+    and refreshed every COUPON_CACHE_TTL seconds, so no lookup reaches the
+    database. A larger table falls back to per-code lookups whose results,
+    including unknown codes, are kept in a bounded TTL cache. Commits that
+    touch Coupons in this process drop the cache immediately.
+
+    Failed attempts are counted here too, per client address and per cart,
+    so clearing or replaying the session cookie does not reset them. Like
+    the cache, the counts are per process.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("COUPON_CACHE_TTL", 300)
+        app.config.setdefault("COUPON_TABLE_MAX", 10000)
+        app.config.setdefault("COUPON_CODE_CACHE_SIZE", 10000)
+        app.config.setdefault("COUPON_MAX_ATTEMPTS", 10)  # Failed attempts per cart per window
+        app.config.setdefault("COUPON_MAX_ATTEMPTS_PER_IP", 50)  # Higher: shoppers behind one NAT share an address
+        app.config.setdefault("COUPON_ATTEMPT_WINDOW", 900)
+        app.config.setdefault("COUPON_ATTEMPT_CLIENTS", 10000)  # Carts and addresses tracked at once (LRU)
+        ttl = float(app.config["COUPON_CACHE_TTL"])
+        app.extensions['coupon_cache'] = _CouponTable(
+            ttl, int(app.config["COUPON_TABLE_MAX"]),
+            TTLCache(maxsize=int(app.config["COUPON_CODE_CACHE_SIZE"]), ttl=ttl),
+            TTLCache(maxsize=int(app.config["COUPON_ATTEMPT_CLIENTS"]), ttl=float(app.config["COUPON_ATTEMPT_WINDOW"]))
+        )
+
+    @property
+    def _state(self):
+        return current_app.extensions['coupon_cache']
+
+    def _load_table(self, state):
+        rows = db.session.execute(
+            select(Coupons.code, Coupons.discount).limit(state.table_max + 1)
+        ).all()
+        state.reloads += 1
+        if len(rows) > state.table_max:
+            logger.info(f"Coupons table exceeds {state.table_max} rows; caching per code")
+            return None
+        logger.info(f"Loaded {len(rows)} coupons into cache")
+        return {row.code: row.discount for row in rows}
+
+    def _snapshot(self, state):
+        now = time.monotonic()
+        with state.lock:
+            if now < state.expires_at:
+                return state.table
+        table = self._load_table(state)
+        with state.lock:
+            state.table = table
+            state.expires_at = now + state.ttl
+        return table
+
+    def lookup(self, code):
+        """Return the discount for `code`, or None if the code does not exist."""
+        state = self._state
+        table = self._snapshot(state)
+        if table is not None:
+            state.table_hits += 1
+            return table.get(code)
+        # Unknown codes are cached as None; a zero discount is still a valid code
+        return state.codes.get_or_load(
+            code,
+            lambda: db.session.execute(
+                select(Coupons.discount).where(Coupons.code == code)
+            ).scalar_one_or_none()
+        )
+
+    def invalidate(self):
+        state = self._state
+        with state.lock:
+            state.table = None
+            state.expires_at = 0.0
+        state.codes.clear()
+
+    def stats(self):
+        state = self._state
+        stats = {'table_hits': state.table_hits, 'reloads': state.reloads,
+                 'mode': 'table' if state.table is not None else 'per-code'}
+        stats['codes'] = state.codes.stats()
+        return stats
+
+
+coupon_cache = CouponCache()
+
+
+def _attempt_limits():
+    """Return `[(key, max attempts), ...]` for the counters this request's failures count against."""
+    config = current_app.config
+    limits = [(('ip', request.remote_addr), int(config["COUPON_MAX_ATTEMPTS_PER_IP"]))]
+    cart_id = cart_store.cart_id()
+    if cart_id:
+        limits.append((('cart', cart_id), int(config["COUPON_MAX_ATTEMPTS"])))
+    return limits
+
+
+def coupon_attempts_exceeded():
+    """Whether this client or cart has used up its failed coupon attempts for the current window."""
+    attempts = current_app.extensions['coupon_cache'].attempts
+    window = float(current_app.config["COUPON_ATTEMPT_WINDOW"])
+    now = time.time()
+    for key, max_attempts in _attempt_limits():
+        count, started = attempts.get(key, (0, 0))
+        if now - started <= window and count >= max_attempts:
+            return True
+    return False
+
+
+def record_failed_coupon_attempt():
+    state = current_app.extensions['coupon_cache']
+    window = float(current_app.config["COUPON_ATTEMPT_WINDOW"])
+    now = time.time()
+    with state.lock:
+        for key, _ in _attempt_limits():
+            count, started = state.attempts.get(key, (0, 0))
+            if now - started > window:
+                count, started = 0, now
+            state.attempts.set(key, (count + 1, started))
+
+
+def clear_coupon_attempts():
+    """Forget the current cart's failed attempts after a valid code; its address keeps its count."""
+    cart_id = cart_store.cart_id()
+    if cart_id:
+        current_app.extensions['coupon_cache'].attempts.pop(('cart', cart_id))
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_coupon_changes(session, flush_context):
+    if any(isinstance(obj, Coupons) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['coupons_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('coupons_dirty', False) and has_app_context():
+        coupon_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('coupons_dirty', None)
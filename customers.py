@@ -0,0 +1,75 @@
+import logging
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from db import db, Customers
+from db_helpers import UPSERT_DIALECTS
+from catalog_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class CustomerResolver:
+    """Resolves a checkout email to a customer id in one round trip.
+
+    On Postgres and SQLite this is a single `INSERT ... ON CONFLICT (email) DO
+    UPDATE ... RETURNING customer_id`, so concurrent first orders for the same
+    email cannot race into an IntegrityError. Ids are cached per process once
+    the order that used them has committed (see `remember`).
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CUSTOMER_CACHE_SIZE", 10000)
+        app.config.setdefault("CUSTOMER_CACHE_TTL", 3600)
+        app.extensions['customer_resolver'] = TTLCache(
+            maxsize=int(app.config["CUSTOMER_CACHE_SIZE"]),
+            ttl=float(app.config["CUSTOMER_CACHE_TTL"])
+        )
+
+    @property
+    def _cache(self):
+        return current_app.extensions['customer_resolver']
+
+    def resolve(self, email, full_name, phone_no):
+        """Return the customer id for `email`, creating the customer if needed.
+
+        Runs inside the caller's transaction and does not commit.
+        """
+        customer_id = self._cache.get(email)
+        if customer_id is not None:
+            return customer_id
+
+        insert = UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+        if insert is not None:
+            stmt = insert(Customers).values(full_name=full_name, phone_no=phone_no, email=email)
+            # A no-op update so RETURNING also yields the existing row's id
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Customers.email],
+                set_={'email': stmt.excluded.email}
+            ).returning(Customers.customer_id)
+            return db.session.execute(stmt).scalar_one()
+
+        # Other databases: look up, then insert inside a savepoint and retry the lookup on a race
+        customer = Customers.query.filter_by(email=email).first()
+        if customer:
+            return customer.customer_id
+        try:
+            with db.session.begin_nested():
+                customer = Customers(full_name=full_name, phone_no=phone_no, email=email)
+                db.session.add(customer)
+            return customer.customer_id
+        except IntegrityError:
+            return Customers.query.filter_by(email=email).one().customer_id
+
+    def remember(self, email, customer_id):
+        """Cache a customer id once the transaction that resolved it has committed."""
+        self._cache.set(email, customer_id)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+customer_resolver = CustomerResolver()
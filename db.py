@@ -1,14 +1,24 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy import Column, Integer, ForeignKey, String, Numeric, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, ForeignKey, String, Numeric, Date, DateTime, DDL, Index, event, func, text
+from sqlalchemy.orm import column_property, relationship
 from flask_login import UserMixin
+from db_routing import RoutingSession
 
-# Initialize SQLAlchemy (without app)
-db = SQLAlchemy()
+# Initialize SQLAlchemy (without app); the session routes reads to a replica bind when one is configured
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Products(db.Model):
     __tablename__ = 'products'
+    # /shop filter + sort combinations; product_id last so keyset pages seek within the index
+    __table_args__ = (
+        Index('ix_products_category_id', 'category', 'product_id'),
+        Index('ix_products_category_price', 'category', 'selling_price', 'product_id'),
+        Index('ix_products_category_name', 'category', 'product_name', 'product_id'),
+        Index('ix_products_price', 'selling_price', 'product_id'),
+        Index('ix_products_name', 'product_name', 'product_id'),
+    )
     product_id = db.Column(db.Integer, primary_key=True)
     product_name = db.Column(db.String(255), nullable=False)
     buying_price = db.Column(db.Numeric(precision=15, scale=2), nullable=False)
@@ -20,6 +30,20 @@ class Products(db.Model):
     description = db.Column(db.String(255))  # Added for product.json
     sales_details = relationship("SaleDetails", back_populates="product")
 
+def product_search_document():
+    """Weighted tsvector over name (A), category (B) and description (C)."""
+    def weighted(column, weight):
+        return func.setweight(func.to_tsvector(text("'simple'::regconfig"), func.coalesce(column, '')), weight)
+    return weighted(Products.product_name, 'A').op('||')(
+        weighted(Products.category, 'B')).op('||')(
+        weighted(Products.description, 'C'))
+
+# Full-text and trigram indexes backing search.py (Postgres only)
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+Index('ix_products_search_document', product_search_document(), postgresql_using='gin').ddl_if(dialect='postgresql')
+Index('ix_products_name_trgm', Products.product_name, postgresql_using='gin',
+      postgresql_ops={'product_name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+
 class Users(db.Model, UserMixin):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -28,6 +52,10 @@ class Users(db.Model, UserMixin):
 
 class SaleDetails(db.Model):
     __tablename__ = 'sale_details'
+    __table_args__ = (
+        Index('ix_sale_details_sale_id', 'sale_id'),
+        Index('ix_sale_details_product_id', 'product_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sales.sale_id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), nullable=False)
@@ -38,10 +66,16 @@ class SaleDetails(db.Model):
 
 class Sales(db.Model):
     __tablename__ = 'sales'
+    __table_args__ = (
+        Index('ix_sales_created_at', 'created_at'),
+        Index('ix_sales_customer_id', 'customer_id'),
+    )
     sale_id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.customer_id'), nullable=False)
     total_amount = db.Column(db.Numeric(precision=15, scale=2), nullable=False)
-    created_at = db.Column(DateTime, default=db.func.current_timestamp())
+    # UTC from the app, not the database's CURRENT_TIMESTAMP (local time on a non-UTC Postgres): the
+    # rollups' settle window compares it with utcnow()
+    created_at = db.Column(DateTime, default=datetime.utcnow)
     sale_details = relationship("SaleDetails", back_populates="sales")
     customer = relationship("Customers", back_populates="sales")
 
@@ -64,6 +98,7 @@ class Employees(db.Model):
 
 class Payments(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (Index('ix_payments_sale_id', 'sale_id'),)
     id = db.Column(db.Integer, primary_key=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sales.sale_id'), nullable=False)
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.customer_id'), nullable=False)
@@ -81,4 +116,126 @@ class Coupons(db.Model):
     __tablename__ = 'coupons'
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(50), unique=True, nullable=False)
-    discount = db.Column(db.Numeric(precision=15, scale=2), nullable=False)
\ No newline at end of file
+    discount = db.Column(db.Numeric(precision=15, scale=2), nullable=False)
+
+class CartItems(db.Model):
+    __tablename__ = 'cart_items'
+    __table_args__ = (db.UniqueConstraint('cart_id', 'product_id', 'size', 'color', name='uq_cart_items_line'),)
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.String(36), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), nullable=False)
+    size = db.Column(db.String(50), nullable=False, default='')  # '' rather than NULL so the unique key holds
+    color = db.Column(db.String(50), nullable=False, default='')
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Numeric(precision=15, scale=2), nullable=False)
+    name = db.Column(db.String(255))
+    image = db.Column(db.String(255))
+    updated_at = db.Column(DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+# Rollups maintained incrementally by rollups.py; dashboards read these instead of the order tables
+class DailyProductSales(db.Model):
+    __tablename__ = 'daily_product_sales'
+    day = db.Column(Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), primary_key=True)
+    units = db.Column(db.Numeric(precision=15, scale=2), nullable=False, default=0)
+    revenue = db.Column(db.Numeric(precision=15, scale=2), nullable=False, default=0)
+    cost = db.Column(db.Numeric(precision=15, scale=2), nullable=False, default=0)  # units x buying_price at rollup time
+
+class DailyCategorySales(db.Model):
+    __tablename__ = 'daily_category_sales'
+    day = db.Column(Date, primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)  # '' for uncategorised products
+    units = db.Column(db.Numeric(precision=15, scale=2), nullable=False, default=0)
+    revenue = db.Column(db.Numeric(precision=15, scale=2), nullable=False, default=0)
+
+class DailyPaymentSales(db.Model):
+    __tablename__ = 'daily_payment_sales'
+    day = db.Column(Date, primary_key=True)
+    payment_method = db.Column(db.String(255), primary_key=True)
+    payments = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Numeric(precision=15, scale=2), nullable=False, default=0)
+
+class RollupState(db.Model):
+    __tablename__ = 'rollup_state'
+    name = db.Column(db.String(50), primary_key=True)
+    last_sale_id = db.Column(db.Integer, nullable=False, default=0)  # High-water mark: sales up to here are rolled up
+    updated_at = db.Column(DateTime)
+
+# "Frequently bought together", built offline by recommendations.py from sale_details
+class CoPurchases(db.Model):
+    __tablename__ = 'co_purchases'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)  # Sales containing both products
+
+class ProductRecommendations(db.Model):
+    __tablename__ = 'product_recommendations'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 0 = most often bought together
+    related_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+
+# Hot-SKU inventory (inventory.py): stock of a sharded product is split across rows so buyers do not queue on one
+class StockShards(db.Model):
+    __tablename__ = 'stock_shards'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Numeric(precision=15, scale=2), nullable=False, default=0)  # Unreserved units left in this shard
+
+class StockReservations(db.Model):
+    __tablename__ = 'stock_reservations'
+    __table_args__ = (
+        Index('ix_stock_reservations_owner', 'owner', 'product_id', 'status'),
+        Index('ix_stock_reservations_expiry', 'status', 'expires_at'),
+        Index('ix_stock_reservations_order_ref', 'order_ref', 'product_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    owner = db.Column(db.String(36), nullable=False)  # Cart id holding the units
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), nullable=False)
+    shard = db.Column(db.Integer, nullable=False)  # Shard the units were taken from, and go back to on release
+    quantity = db.Column(db.Numeric(precision=15, scale=2), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='held')  # held -> confirmed | released
+    expires_at = db.Column(DateTime, nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sales.sale_id'))
+    order_ref = db.Column(db.String(36))  # Queued order (order_pipeline.py) the units were confirmed for
+    created_at = db.Column(DateTime, default=db.func.current_timestamp())
+
+# Deferred: cart and checkout undefer it to choose between the shard and single-row stock paths
+Products.is_sharded = column_property(
+    db.select(StockShards.product_id).where(StockShards.product_id == Products.product_id).exists(),
+    deferred=True
+)
+
+# Outbox of accepted checkouts, turned into sales by order_pipeline.py workers (ORDER_PIPELINE=async)
+class OrderIntents(db.Model):
+    __tablename__ = 'order_intents'
+    __table_args__ = (Index('ix_order_intents_queue', 'status', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    order_ref = db.Column(db.String(36), nullable=False, unique=True)  # Public order id returned by checkout
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending -> processing -> completed | failed
+    payload = db.Column(db.JSON, nullable=False)  # Customer, payment and line items as validated at checkout
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    claimed_by = db.Column(db.String(36))  # Token of the worker claim allowed to complete the intent
+    locked_until = db.Column(DateTime)  # A claim not completed by then may be taken over
+    sale_id = db.Column(db.Integer, db.ForeignKey('sales.sale_id'))
+    error = db.Column(db.String(255))
+    created_at = db.Column(DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+# Change counters for cached catalog reads (catalog_cache.py), bumped in the transaction that changes products
+class CatalogVersions(db.Model):
+    __tablename__ = 'catalog_versions'
+    name = db.Column(db.String(50), primary_key=True)  # 'catalog': anything but stock; 'search': name, category, description
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(DateTime)  # When version last changed (UTC); served as Last-Modified
+
+event.listen(CatalogVersions.__table__, 'after_create', DDL(
+    "INSERT INTO catalog_versions (name, version, updated_at) "
+    "VALUES ('catalog', 0, CURRENT_TIMESTAMP), ('search', 0, CURRENT_TIMESTAMP)"
+))
+
+# Migrations applied to this database by `flask migrate` (schema.py)
+class SchemaMigrations(db.Model):
+    __tablename__ = 'schema_migrations'
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(DateTime, default=db.func.current_timestamp())
\ No newline at end of file
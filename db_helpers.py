@@ -0,0 +1,55 @@
+from datetime import datetime
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from db import db, RollupState, Sales
+
+# Dialects whose insert() supports ON CONFLICT DO UPDATE/NOTHING; others fall back to per-row ORM writes
+UPSERT_DIALECTS = {'postgresql': pg_insert, 'sqlite': sqlite_insert}
+
+
+def sale_watermark(name):
+    """Return the `RollupState` row `name`, creating it at sale 0 if it does not exist yet."""
+    state = db.session.get(RollupState, name)
+    if state is None:
+        try:
+            with db.session.begin_nested():
+                state = RollupState(name=name, last_sale_id=0)
+                db.session.add(state)
+        except IntegrityError:
+            state = db.session.get(RollupState, name)
+    return state
+
+
+def next_sale_batch(after_id, batch_size, settle):
+    """Return (highest sale id, sale count) of the next batch after `after_id`.
+
+    The batch stops short of sales younger than `settle` (a timedelta), whose
+    lines may not all be written yet. `Sales.created_at` is UTC on every
+    write path, so the cutoff is too.
+    """
+    cutoff = datetime.utcnow() - settle
+    rows = db.session.execute(
+        select(Sales.sale_id, Sales.created_at)
+        .where(Sales.sale_id > after_id).order_by(Sales.sale_id).limit(batch_size)
+    ).all()
+    upper, count = None, 0
+    for row in rows:
+        if row.created_at is not None and row.created_at > cutoff:
+            break
+        upper, count = row.sale_id, count + 1
+    return upper, count
+
+
+def advance_sale_watermark(name, lower, upper):
+    """Move watermark `name` from `lower` to `upper`; returns False if another worker moved it first.
+
+    Guarded on the old mark, so concurrent refreshes cannot fold a sale in twice.
+    """
+    return bool(db.session.execute(
+        update(RollupState)
+        .where(RollupState.name == name, RollupState.last_sale_id == lower)
+        .values(last_sale_id=upper, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount)
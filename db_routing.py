@@ -0,0 +1,108 @@
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context, session
+from flask_sqlalchemy.session import Session as BaseSession
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+REPLICA = 'replica'
+PRIMARY = 'primary'
+
+
+class RoutingSession(BaseSession):
+    """Session that sends plain SELECTs to the `replica` bind while the request is routed there.
+
+    Anything else - flushes, INSERT/UPDATE/DELETE, `SELECT ... FOR UPDATE`,
+    and every read after a write in the same transaction - stays on the
+    primary, as does everything when no replica bind is configured.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('db_route') == REPLICA:
+            replica = self._db.engines.get(REPLICA)
+            is_read = isinstance(clause, Select) and clause._for_update_arg is None and not self._flushing
+            if not is_read:
+                self.info['db_wrote'] = True
+            elif replica is not None and not self.info.get('db_wrote'):
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+@event.listens_for(RoutingSession, 'after_rollback')
+def _end_of_transaction(session):
+    session.info.pop('db_wrote', None)
+
+
+class DatabaseRouter:
+    """Routes catalog reads to a read replica, with read-your-writes stickiness.
+
+    Configure the replica as `SQLALCHEMY_BINDS['replica']`. Views decorated
+    with `replica_reads` read from it unless this browser session wrote
+    something recently (see `stick_to_primary`).
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("REPLICA_STICKY_SECONDS", 10)
+        app.extensions['db_router'] = self
+
+        @app.cli.command('copy-replica')
+        def copy_replica():
+            """Copy a SQLite primary into the SQLite replica file, for trying out routing locally."""
+            primary = app.config["SQLALCHEMY_DATABASE_URI"]
+            replica = (app.config.get("SQLALCHEMY_BINDS") or {}).get(REPLICA)
+            replica = replica.get('url') if isinstance(replica, dict) else replica
+            if not replica or not primary.startswith('sqlite:///') or not replica.startswith('sqlite:///'):
+                raise SystemExit("copy-replica needs SQLite URIs for both the primary and the replica bind")
+            source = sqlite3.connect(primary[len('sqlite:///'):])
+            target = sqlite3.connect(replica[len('sqlite:///'):])
+            with target:
+                source.backup(target)
+            source.close()
+            target.close()
+            logger.info(f"Copied {primary} to {replica}")
+
+    @property
+    def has_replica(self):
+        return REPLICA in (current_app.config.get("SQLALCHEMY_BINDS") or {})
+
+    def stick_to_primary(self):
+        """Pin this browser session's reads to the primary for REPLICA_STICKY_SECONDS."""
+        sticky_seconds = int(current_app.config["REPLICA_STICKY_SECONDS"])
+        if self.has_replica and sticky_seconds > 0:
+            session['db_primary_until'] = time.time() + sticky_seconds
+
+    def replica_reads(self, view):
+        """Decorator: route the view's reads (including streamed responses) to the replica."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get('db_primary_until', 0) > time.time():
+                g.db_route = PRIMARY
+            else:
+                if 'db_primary_until' in session:
+                    session.pop('db_primary_until')
+                g.db_route = REPLICA
+            return view(*args, **kwargs)
+        return wrapper
+
+    @contextmanager
+    def primary(self):
+        """Force reads inside the block onto the primary, e.g. for bookkeeping done during a replica view."""
+        previous = g.get('db_route')
+        g.db_route = PRIMARY
+        try:
+            yield
+        finally:
+            g.db_route = previous
+
+
+db_router = DatabaseRouter()
@@ -0,0 +1,73 @@
+import logging
+from flask import current_app
+from sqlalchemy import case, func
+from db import Products
+from catalog_cache import catalog_cache
+from search import product_search
+
+logger = logging.getLogger(__name__)
+
+
+class ShopFacets:
+    """Per-category and per-price-bucket counts for the /shop sidebar.
+
+    All counts come from a single `GROUP BY category` query with one
+    `SUM(CASE ...)` column per price bucket. Each facet honours the other
+    active filters: category counts apply the price filter, bucket counts
+    apply the category filter, and both apply the search term. Results are
+    cached per filter combination in the catalog cache, so they are dropped
+    with it when the catalog changes.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SHOP_PRICE_BUCKETS", ((0, 5000), (5000, 20000), (20000, 50000)))
+        app.extensions['shop_facets'] = self
+
+    @property
+    def buckets(self):
+        return tuple((int(low), int(high)) for low, high in current_app.config["SHOP_PRICE_BUCKETS"])
+
+    def counts(self, category=None, price_bounds=None, search=None):
+        """Return facet counts for the given filters.
+
+        The result is a dict with `categories` (list of `(category, count)`),
+        `prices` (list of `(value, low, high, count)`, where `value` is the
+        `price=` query parameter), `all_categories` (matches in any category)
+        and `all_prices` (matches at any price).
+        """
+        return catalog_cache.get_or_load(
+            ('facets', category, price_bounds, search),
+            lambda: self._load(category, price_bounds, search)
+        )
+
+    def _load(self, category, price_bounds, search):
+        price = Products.selling_price
+        buckets = self.buckets
+        in_price = func.sum(case((price.between(*price_bounds), 1), else_=0)) if price_bounds else func.count()
+        query = Products.query.with_entities(
+            Products.category,
+            func.count().label('products'),
+            in_price.label('in_price'),
+            *(func.sum(case((price.between(low, high), 1), else_=0)) for low, high in buckets)
+        )
+        if search:
+            query = product_search.apply(query, search, rank=False)
+        rows = query.group_by(Products.category).all()
+
+        in_category = [row for row in rows if category is None or row.category == category]
+        return {
+            'categories': sorted((row.category, int(row.in_price)) for row in rows if row.category),
+            'prices': [
+                (f"{low}-{high}", low, high, sum(int(row[3 + i]) for row in in_category))
+                for i, (low, high) in enumerate(buckets)
+            ],
+            'all_categories': sum(int(row.in_price) for row in rows),
+            'all_prices': sum(row.products for row in in_category)
+        }
+
+
+shop_facets = ShopFacets()
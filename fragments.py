@@ -0,0 +1,91 @@
+import logging
+import threading
+from collections import defaultdict
+from flask import current_app
+from markupsafe import Markup
+from catalog_cache import TTLCache, catalog_cache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_params(args, names):
+    """Reduce request args to the `names` that affect a fragment, so equivalent URLs share an entry.
+
+    Unknown parameters (tracking tags and the like) are dropped, blank values
+    are treated as absent and whitespace in values is collapsed.
+    """
+    params = {}
+    for name in names:
+        value = ' '.join((args.get(name) or '').split())
+        if value:
+            params[name] = value
+    return params
+
+
+class _FragmentState:
+    """One app's rendered fragments and per-fragment hit counts."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.counts = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self.lock = threading.Lock()
+
+
+class FragmentCache:
+    """Cache of rendered, catalog-derived template fragments.
+
+    Only HTML that is the same for every visitor belongs here (product grids,
+    category navigation); per-user parts such as the CSRF token and cart badge
+    stay in the page template around it. Keys include the catalog version
+    (see `CatalogCache.version`), so a commit that changes `Products` in any
+    process makes every cached fragment unreachable.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("FRAGMENT_CACHE_SIZE", 512)
+        app.config.setdefault("FRAGMENT_CACHE_TTL", 300)
+        app.extensions['fragment_cache'] = _FragmentState(TTLCache(
+            maxsize=int(app.config["FRAGMENT_CACHE_SIZE"]),
+            ttl=float(app.config["FRAGMENT_CACHE_TTL"])
+        ))
+
+    @property
+    def _state(self):
+        return current_app.extensions['fragment_cache']
+
+    def version(self):
+        # The catalog change counter, shared by every process using the database
+        return catalog_cache.version()[0]
+
+    def render(self, name, render, params=None):
+        """Return the fragment `name` for `params`, calling `render()` (which returns HTML) on a miss."""
+        state = self._state
+        key = (name, self.version(), tuple(sorted((params or {}).items())))
+        sentinel = object()
+        html = state.cache.get(key, sentinel)
+        with state.lock:
+            state.counts[name]['hits' if html is not sentinel else 'misses'] += 1
+        if html is sentinel:
+            html = Markup(render())
+            state.cache.set(key, html)
+        return html
+
+    def clear(self):
+        self._state.cache.clear()
+
+    def stats(self):
+        state = self._state
+        stats = state.cache.stats()
+        with state.lock:
+            stats['fragments'] = {
+                name: dict(counts, hit_rate=round(counts['hits'] / (counts['hits'] + counts['misses']), 4))
+                for name, counts in state.counts.items()
+            }
+        return stats
+
+
+fragment_cache = FragmentCache()
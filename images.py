@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import click
+from flask import current_app, redirect, request, send_file, url_for
+from sqlalchemy import select
+from werkzeug.exceptions import BadRequest, NotFound
+from werkzeug.security import safe_join
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: without Pillow, image_url() points at the original files
+    Image = None
+
+from db import db, Products
+from assets import assets
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+SOURCE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+TOUCH_INTERVAL = 24 * 3600  # Refresh a cached variant's mtime (its LRU position) at most this often
+
+
+class _VariantStore:
+    """One app's disk cache of rendered variants."""
+
+    def __init__(self, static_folder, cache_dir, max_bytes, quality):
+        self.static_folder = static_folder
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._digests = {}  # (path, mtime, size) -> source digest
+        self._cache_bytes = None
+
+    def source_path(self, filename):
+        path = safe_join(self.static_folder, filename)
+        if path is None or os.path.splitext(path)[1].lower() not in SOURCE_EXTENSIONS or not os.path.isfile(path):
+            return None
+        return path
+
+    def _source_digest(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self._digests.get(key)
+        if digest is None:
+            with open(path, 'rb') as file:
+                digest = self._digests[key] = hashlib.sha256(file.read()).hexdigest()
+        return digest
+
+    def _lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def variant(self, filename, width, fmt):
+        """Return (path, etag) of the cached variant, rendering it if needed."""
+        source = self.source_path(filename)
+        if source is None:
+            raise NotFound()
+        key = hashlib.sha256(
+            f"{self._source_digest(source)}:{width}:{fmt}:{self.quality}".encode()
+        ).hexdigest()[:32]
+        path = os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+        if os.path.exists(path):
+            if time.time() - os.path.getmtime(path) > TOUCH_INTERVAL:
+                os.utime(path)
+            return path, key
+        with self._lock(key):
+            if not os.path.exists(path):
+                self._render(source, path, width, fmt)
+        with self._locks_guard:
+            self._locks.pop(key, None)
+        return path, key
+
+    def _render(self, source, path, width, fmt):
+        pil_format, _ = FORMATS[fmt]
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                image.thumbnail((width, image.height * width // image.width or 1), Image.LANCZOS)
+            if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file and rename, so readers never see a partial image
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    image.save(file, pil_format, quality=self.quality, optimize=True)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        self._account(path)
+
+    def _scan(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(full)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, full))
+        return entries
+
+    def _account(self, written):
+        with self._locks_guard:
+            if self._cache_bytes is None:
+                self._cache_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._cache_bytes += os.path.getsize(written)
+            if self._cache_bytes <= self.max_bytes:
+                return
+            # Evict least recently used variants down to 90% of the limit
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            evicted = 0
+            for _, size, full in entries:
+                if total <= target:
+                    break
+                if full == written:  # About to be served
+                    continue
+                try:
+                    os.unlink(full)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+            self._cache_bytes = total
+            logger.info(f"Evicted {evicted} image variants; cache now {total / 1024 / 1024:.1f} MiB")
+
+
+class ImageVariants:
+    """Width-bounded JPEG/WebP variants of static images, generated on first request.
+
+    Variants live in a content-addressed disk cache: the file name is a hash
+    of the source bytes and the variant parameters, which doubles as a strong
+    ETag. The cache is trimmed, oldest first, to IMAGE_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = Image is not None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("IMAGE_CACHE_DIR", os.path.join(app.instance_path, 'image-cache'))
+        app.config.setdefault("IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+        app.config.setdefault("IMAGE_WIDTHS", (160, 320, 480, 640, 960, 1280))
+        app.config.setdefault("IMAGE_QUALITY", 80)
+        app.config.setdefault("IMAGE_MAX_AGE", 24 * 3600)
+        store = app.extensions['images'] = _VariantStore(
+            app.static_folder,
+            app.config["IMAGE_CACHE_DIR"],
+            int(app.config["IMAGE_CACHE_MAX_BYTES"]),
+            int(app.config["IMAGE_QUALITY"])
+        )
+        app.add_template_global(self.url, 'image_url')
+        app.add_url_rule('/images/<int:width>/<path:filename>', 'image_variant', self.serve)
+        if not self.enabled:
+            logger.warning("Pillow is not installed; product images are served at full size")
+
+        @app.cli.command('warm-images')
+        @click.option('--width', 'widths', type=int, multiple=True, help="Widths to render (default: all IMAGE_WIDTHS).")
+        @click.option('--format', 'formats', type=click.Choice(sorted(FORMATS)), multiple=True)
+        def warm_images(widths, formats):
+            """Pre-render image variants for every product image."""
+            if not self.enabled:
+                raise SystemExit("Pillow is required to render image variants")
+            images = db.session.scalars(select(Products.image).where(Products.image.isnot(None)).distinct()).all()
+            rendered = 0
+            for image in images:
+                if store.source_path(image) is None:
+                    logger.warning(f"Skipping missing image {image}")
+                    continue
+                for width in widths or self.widths:
+                    for fmt in formats or FORMATS:
+                        store.variant(image, width, fmt)
+                        rendered += 1
+            logger.info(f"Warmed {rendered} variants of {len(images)} images")
+
+    @property
+    def widths(self):
+        return tuple(sorted(current_app.config["IMAGE_WIDTHS"]))
+
+    def url(self, filename, width):
+        """URL of `filename` (relative to static/) at most `width` pixels wide."""
+        if not filename or '://' in filename or filename.startswith('/'):
+            return filename
+        if not self.enabled:
+            return self._original_url(filename)
+        # Snap to the next configured width so the cache holds a bounded set of variants
+        widths = self.widths
+        width = next((w for w in widths if w >= width), widths[-1])
+        return url_for('image_variant', width=width, filename=filename)
+
+    def _original_url(self, filename):
+        return assets.url(filename) if 'assets' in current_app.extensions else url_for('static', filename=filename)
+
+    def variant(self, filename, width, fmt):
+        """Return (path, etag) of the cached variant, rendering it if needed."""
+        return current_app.extensions['images'].variant(filename, width, fmt)
+
+    def serve(self, width, filename):
+        """Serve a variant; ?format=webp|jpeg, otherwise WebP when the browser accepts it."""
+        if not self.enabled:
+            return redirect(self._original_url(filename))
+        widths = self.widths
+        if width not in widths:
+            raise BadRequest(f"width must be one of {', '.join(map(str, widths))}")
+        fmt = request.args.get('format')
+        if fmt is None:
+            fmt = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
+        elif fmt not in FORMATS:
+            raise BadRequest(f"format must be one of {', '.join(FORMATS)}")
+        path, etag = self.variant(filename, width, fmt)
+        max_age = int(current_app.config["IMAGE_MAX_AGE"])
+        response = send_file(path, mimetype=FORMATS[fmt][1], etag=etag, max_age=max_age, conditional=True)
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+        if 'format' not in request.args:
+            response.vary.add('Accept')
+        return response
+
+
+image_variants = ImageVariants()
@@ -0,0 +1,313 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+import click
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+from db import db, Products, StockShards, StockReservations
+
+logger = logging.getLogger(__name__)
+
+HELD = 'held'
+CONFIRMED = 'confirmed'
+RELEASED = 'released'
+FAST_PATH_ATTEMPTS = 3  # Random single-shard takes tried before gathering from several shards
+
+
+class InventoryReservations:
+    """Time-limited stock reservations for hot SKUs, taken from sharded counters.
+
+    `shard(product_id)` moves a product's stock into INVENTORY_SHARDS rows of
+    `stock_shards`. From then on cart holds and checkouts for it decrement a
+    randomly picked shard instead of the single `products` row, so concurrent
+    buyers of one SKU rarely wait on the same row lock. Each take is recorded
+    in `stock_reservations` as `held` until checkout confirms it or it expires
+    and is released back to its shard.
+
+    While a product is sharded its `stock_quantity` is a mirror of the
+    unreserved units, refreshed by `reconcile()`; `unshard()` folds the shards
+    back. Shard a product before its promotion starts: a checkout already in
+    flight when it is sharded still decrements the `products` row.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("INVENTORY_SHARDS", 8)
+        app.config.setdefault("INVENTORY_HOLD_MINUTES", 15)
+        app.extensions['inventory'] = self
+
+        @app.cli.command('shard-stock')
+        @click.argument('product_id', type=int)
+        @click.option('--shards', type=int, default=None, help="Counter rows to split the stock across.")
+        def shard_stock(product_id, shards):
+            """Split a hot product's stock across sharded counter rows."""
+            self.shard(product_id, shards)
+            db.session.commit()
+
+        @app.cli.command('unshard-stock')
+        @click.argument('product_id', type=int)
+        def unshard_stock(product_id):
+            """Fold a product's shards (and open holds) back into products.stock_quantity."""
+            self.unshard(product_id)
+            db.session.commit()
+
+        @app.cli.command('reconcile-stock')
+        @click.option('--interval', type=float, default=None, help="Keep running, reconciling every N seconds.")
+        def reconcile_stock(interval):
+            """Release expired holds and refresh stock_quantity of sharded products."""
+            while True:
+                released, refreshed = self.reconcile()
+                logger.info(f"Released {released} expired holds; refreshed stock of {refreshed} products")
+                if not interval:
+                    break
+                time.sleep(interval)
+
+    @property
+    def shards(self):
+        return int(current_app.config["INVENTORY_SHARDS"])
+
+    @property
+    def hold_ttl(self):
+        return timedelta(minutes=float(current_app.config["INVENTORY_HOLD_MINUTES"]))
+
+    def shard(self, product_id, shards=None):
+        """Move `product_id`'s stock into `shards` counter rows, split evenly."""
+        shards = shards or self.shards
+        product = db.session.get(Products, product_id, with_for_update=True)
+        if product is None:
+            raise click.ClickException(f"Product {product_id} not found")
+        if db.session.scalar(select(func.count()).where(StockShards.product_id == product_id)):
+            raise click.ClickException(f"Product {product_id} is already sharded; unshard it first")
+        stock = Decimal(product.stock_quantity)
+        base, extra = divmod(int(stock), shards)
+        db.session.add_all(
+            StockShards(product_id=product_id, shard=shard, quantity=base + (1 if shard < extra else 0))
+            for shard in range(shards)
+        )
+        # Fractional stock, if any, stays with the first shard
+        if stock != int(stock):
+            db.session.flush()
+            self._give_back(product_id, 0, stock - int(stock))
+        logger.info(f"Sharded stock of product {product_id} ({stock}) across {shards} rows")
+
+    def unshard(self, product_id):
+        """Fold shards and open holds back into `products.stock_quantity`, dropping the holds."""
+        shards = db.session.execute(
+            select(StockShards.quantity).where(StockShards.product_id == product_id).with_for_update()
+        ).scalars().all()
+        held = db.session.execute(
+            update(StockReservations)
+            .where(StockReservations.product_id == product_id, StockReservations.status == HELD)
+            .values(status=RELEASED)
+            .returning(StockReservations.quantity)
+        ).scalars().all()
+        total = sum(shards, Decimal(0)) + sum(held, Decimal(0))
+        db.session.execute(delete(StockShards).where(StockShards.product_id == product_id))
+        db.session.execute(update(Products).where(Products.product_id == product_id).values(stock_quantity=total))
+        logger.info(f"Unsharded product {product_id}: stock {total}, {len(held)} holds dropped")
+
+    def _take(self, product_id, quantity):
+        """Decrement shards of `product_id` by `quantity`; returns [(shard, taken)] or None if short."""
+        for _ in range(FAST_PATH_ATTEMPTS):
+            # Pick a random shard that can cover the whole quantity; the outer guard
+            # catches a concurrent buyer emptying it between the pick and the update
+            candidate = (
+                select(StockShards.shard)
+                .where(StockShards.product_id == product_id, StockShards.quantity >= quantity)
+                .order_by(func.random()).limit(1).scalar_subquery()
+            )
+            shard = db.session.execute(
+                update(StockShards)
+                .where(StockShards.product_id == product_id, StockShards.shard == candidate,
+                       StockShards.quantity >= quantity)
+                .values(quantity=StockShards.quantity - quantity)
+                .returning(StockShards.shard)
+                .execution_options(synchronize_session=False)
+            ).scalar()
+            if shard is not None:
+                return [(shard, quantity)]
+            if not db.session.scalar(select(func.count()).where(
+                    StockShards.product_id == product_id, StockShards.quantity >= quantity)):
+                break
+
+        # Near sell-out no single shard has enough: lock them all (in shard order, so
+        # concurrent takers cannot deadlock) and gather the quantity across shards
+        rows = db.session.execute(
+            select(StockShards.shard, StockShards.quantity)
+            .where(StockShards.product_id == product_id, StockShards.quantity > 0)
+            .order_by(StockShards.shard).with_for_update()
+        ).all()
+        if sum((row.quantity for row in rows), Decimal(0)) < quantity:
+            return None
+        taken, remaining = [], Decimal(quantity)
+        for row in rows:
+            take = min(row.quantity, remaining)
+            db.session.execute(
+                update(StockShards)
+                .where(StockShards.product_id == product_id, StockShards.shard == row.shard)
+                .values(quantity=StockShards.quantity - take)
+                .execution_options(synchronize_session=False)
+            )
+            taken.append((row.shard, take))
+            remaining -= take
+            if not remaining:
+                break
+        return taken
+
+    def _give_back(self, product_id, shard, quantity):
+        db.session.execute(
+            update(StockShards)
+            .where(StockShards.product_id == product_id, StockShards.shard == shard)
+            .values(quantity=StockShards.quantity + quantity)
+            .execution_options(synchronize_session=False)
+        )
+
+    def _release(self, reservation):
+        # The status guard makes a release idempotent when the reconciler and a cart race for it
+        released = db.session.execute(
+            update(StockReservations)
+            .where(StockReservations.id == reservation.id, StockReservations.status == HELD)
+            .values(status=RELEASED)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if released:
+            self._give_back(reservation.product_id, reservation.shard, reservation.quantity)
+        return released
+
+    def _held(self, owner, product_id):
+        return db.session.execute(
+            select(StockReservations.id, StockReservations.product_id, StockReservations.shard,
+                   StockReservations.quantity, StockReservations.expires_at)
+            .where(StockReservations.owner == owner, StockReservations.product_id == product_id,
+                   StockReservations.status == HELD)
+            .order_by(StockReservations.id)
+        ).all()
+
+    def hold(self, owner, product_id, quantity):
+        """Make `owner` hold exactly `quantity` units of a sharded product for INVENTORY_HOLD_MINUTES.
+
+        Takes or releases the difference from what the owner already holds and
+        extends the expiry of the remaining holds. Returns False when there is
+        not enough unreserved stock. Runs in the current transaction; the
+        caller commits.
+        """
+        now = datetime.utcnow()
+        held = []
+        for row in self._held(owner, product_id):
+            # Expired holds are released here rather than extended, so the reconciler
+            # cannot release one between this read and a confirm
+            if row.expires_at < now:
+                self._release(row)
+            else:
+                held.append(row)
+        current = sum((row.quantity for row in held), Decimal(0))
+        expires_at = now + self.hold_ttl
+        if quantity > current:
+            taken = self._take(product_id, quantity - current)
+            if taken is None:
+                return False
+            db.session.execute(StockReservations.__table__.insert(), [
+                {'owner': owner, 'product_id': product_id, 'shard': shard, 'quantity': amount,
+                 'status': HELD, 'expires_at': expires_at}
+                for shard, amount in taken
+            ])
+        elif quantity < current:
+            # Release the newest holds first, then take back any overshoot
+            for row in reversed(held):
+                if current <= quantity:
+                    break
+                current -= row.quantity * self._release(row)
+            if current < quantity and not self.hold(owner, product_id, quantity):
+                return False
+        db.session.execute(
+            update(StockReservations)
+            .where(StockReservations.owner == owner, StockReservations.product_id == product_id,
+                   StockReservations.status == HELD)
+            .values(expires_at=expires_at)
+            .execution_options(synchronize_session=False)
+        )
+        return True
+
+    def confirm(self, owner, product_id, quantity, sale_id=None, order_ref=None):
+        """Turn `owner`'s holds on `product_id` into `quantity` sold units of `sale_id`.
+
+        An asynchronous checkout has no sale yet and passes the queued order's
+        `order_ref` instead, for `attach` or `cancel` to find the units by.
+        Tops up or trims the holds first, so a cart whose holds expired can
+        still check out while stock lasts. Returns False when it cannot.
+        """
+        if not self.hold(owner, product_id, quantity):
+            return False
+        db.session.execute(
+            update(StockReservations)
+            .where(StockReservations.owner == owner, StockReservations.product_id == product_id,
+                   StockReservations.status == HELD)
+            .values(status=CONFIRMED, sale_id=sale_id, order_ref=order_ref)
+            .execution_options(synchronize_session=False)
+        )
+        return True
+
+    def attach(self, order_ref, product_id, sale_id):
+        """Record `sale_id` on units confirmed for queued order `order_ref` before its sale existed."""
+        db.session.execute(
+            update(StockReservations)
+            .where(StockReservations.order_ref == order_ref, StockReservations.product_id == product_id,
+                   StockReservations.status == CONFIRMED, StockReservations.sale_id.is_(None))
+            .values(sale_id=sale_id)
+            .execution_options(synchronize_session=False)
+        )
+
+    def cancel(self, order_ref, product_id):
+        """Return units confirmed for queued order `order_ref`, which will never become a sale, to their shards."""
+        confirmed = db.session.execute(
+            select(StockReservations.id, StockReservations.shard, StockReservations.quantity)
+            .where(StockReservations.order_ref == order_ref, StockReservations.product_id == product_id,
+                   StockReservations.status == CONFIRMED, StockReservations.sale_id.is_(None))
+        ).all()
+        for row in confirmed:
+            released = db.session.execute(
+                update(StockReservations)
+                .where(StockReservations.id == row.id, StockReservations.status == CONFIRMED)
+                .values(status=RELEASED)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if released:
+                self._give_back(product_id, row.shard, row.quantity)
+
+    def release_expired(self, limit=1000):
+        """Return expired holds to their shards; returns how many were released."""
+        expired = db.session.execute(
+            select(StockReservations.id, StockReservations.product_id, StockReservations.shard, StockReservations.quantity)
+            .where(StockReservations.status == HELD, StockReservations.expires_at < datetime.utcnow())
+            .order_by(StockReservations.id).limit(limit)
+        ).all()
+        return sum(self._release(row) for row in expired)
+
+    def reconcile(self):
+        """Release expired holds and copy each sharded product's unreserved total into `stock_quantity`.
+
+        Only rows whose total changed are written, so an idle catalog is not
+        invalidated on every run. Commits; returns (released, refreshed).
+        """
+        released = self.release_expired()
+        db.session.commit()
+        totals = db.session.execute(
+            select(StockShards.product_id, func.sum(StockShards.quantity).label('total'), Products.stock_quantity)
+            .join(Products, Products.product_id == StockShards.product_id)
+            .group_by(StockShards.product_id, Products.stock_quantity)
+        ).all()
+        changed = [row for row in totals if row.total != row.stock_quantity]
+        for row in changed:
+            db.session.execute(
+                update(Products).where(Products.product_id == row.product_id).values(stock_quantity=row.total)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+        return released, len(changed)
+
+
+inventory = InventoryReservations()
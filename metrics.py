@@ -0,0 +1,201 @@
+import bisect
+import logging
+import threading
+import time
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Gauge:
+    """A value read at scrape time: `collect()` returns `{labels: value}`."""
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect or dict
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus text format."""
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, [list(s[0]), s[1], s[2]]) for labels, s in self._series.items())
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Metrics:
+    """Per-endpoint request latency and per-request SQL counts, served at /metrics.
+
+    Timing uses `before_request`/`teardown_request` and SQLAlchemy cursor
+    events; each costs a couple of `perf_counter` calls and a dict update.
+    Values are kept per process, so with several workers scrape each one (or
+    sum in Prometheus).
+    """
+
+    def __init__(self, app=None):
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Time spent handling a request.', ('endpoint', 'method', 'status'))
+        self.request_queries = Histogram(
+            'http_request_db_queries', 'SQL statements issued per request.', ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_query_time = Histogram(
+            'http_request_db_seconds', 'Time spent in SQL per request.', ('endpoint',))
+        self.query_latency = Histogram('db_query_duration_seconds', 'Time spent executing one SQL statement.')
+        self.slow_requests = Counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.', ('endpoint',))
+        self.registry = [self.request_latency, self.request_queries, self.request_query_time,
+                         self.query_latency, self.slow_requests]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("METRICS_ENABLED", True)
+        app.config.setdefault("SLOW_REQUEST_MS", 500)
+        app.config.setdefault("SLOW_REQUEST_QUERY_LOG", 50)
+        app.extensions['metrics'] = self
+        if not app.config["METRICS_ENABLED"]:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.expose, methods=['GET'])
+        # Engine events are process-wide: listen once however many apps are built
+        if not event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_query_log_limit = int(current_app.config["SLOW_REQUEST_QUERY_LOG"])
+        g.metrics_queries = 0
+        g.metrics_query_seconds = 0.0
+        g.metrics_statements = []
+
+    def _record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _finish_request(self, exc=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        status = g.pop('metrics_status', 500)
+        self.request_latency.observe(elapsed, endpoint, request.method, str(status))
+        self.request_queries.observe(g.metrics_queries, endpoint)
+        self.request_query_time.observe(g.metrics_query_seconds, endpoint)
+        if elapsed >= current_app.config["SLOW_REQUEST_MS"] / 1000.0:
+            self.slow_requests.inc(endpoint)
+            statements = '\n'.join(f"  {ms:8.2f} ms  {' '.join(sql.split())[:300]}" for sql, ms in g.metrics_statements)
+            more = g.metrics_queries - len(g.metrics_statements)
+            logger.warning(
+                f"Slow request: {request.method} {request.path} -> {status} in {elapsed * 1000:.0f} ms, "
+                f"{g.metrics_queries} queries ({g.metrics_query_seconds * 1000:.0f} ms)"
+                + (f"\n{statements}" if statements else '')
+                + (f"\n  ... {more} more" if more > 0 else '')
+            )
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Kept on the statement's execution context, so a statement that raises leaves nothing behind
+        if context is not None:
+            context.metrics_query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'metrics_query_start', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        self.query_latency.observe(elapsed)
+        if has_request_context() and 'metrics_started' in g:
+            g.metrics_queries += 1
+            g.metrics_query_seconds += elapsed
+            if len(g.metrics_statements) < g.metrics_query_log_limit:
+                g.metrics_statements.append((statement, elapsed * 1000))
+
+    def register(self, *metrics):
+        """Add metrics kept by other extensions to the /metrics output."""
+        for metric in metrics:
+            if metric not in self.registry:
+                self.registry.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.registry:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def expose(self):
+        """Prometheus scrape endpoint."""
+        return Response(self.render(), mimetype=None, content_type=CONTENT_TYPE)
+
+
+metrics = Metrics()
@@ -0,0 +1,162 @@
+import csv
+import hmac
+import io
+import json
+import logging
+import sys
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import click
+from flask import current_app
+from sqlalchemy import select
+from db import db, Products, Sales, SaleDetails, Customers, Payments
+from rollups import parse_day
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+FLUSH_ROWS = 500  # Rows buffered per yielded chunk, so the response is not one write per row
+
+
+def export_query(start=None, end=None, customer_id=None, email=None):
+    """One row per sale line, with its sale, customer and payment columns (no ORM objects)."""
+    stmt = (
+        select(
+            Sales.sale_id,
+            Sales.created_at,
+            Customers.customer_id,
+            Customers.full_name.label('customer_name'),
+            Customers.email.label('customer_email'),
+            Customers.phone_no.label('customer_phone'),
+            SaleDetails.product_id,
+            Products.product_name,
+            SaleDetails.quantity,
+            SaleDetails.purchase_amount,
+            Sales.total_amount.label('sale_total'),
+            Payments.payment_method,
+            Payments.amount.label('payment_amount')
+        )
+        .select_from(SaleDetails)
+        .join(Sales, Sales.sale_id == SaleDetails.sale_id)
+        .join(Customers, Customers.customer_id == Sales.customer_id)
+        .outerjoin(Products, Products.product_id == SaleDetails.product_id)
+        .outerjoin(Payments, Payments.sale_id == Sales.sale_id)
+        .order_by(Sales.sale_id, SaleDetails.id)
+    )
+    if start:
+        stmt = stmt.where(Sales.created_at >= datetime.combine(start, datetime.min.time()))
+    if end:
+        # `end` is an inclusive day
+        stmt = stmt.where(Sales.created_at < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    if customer_id:
+        stmt = stmt.where(Sales.customer_id == customer_id)
+    if email:
+        stmt = stmt.where(Customers.email == email)
+    return stmt
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def write_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_plain(value) for value in row])
+        if i % FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_jsonl(rows, columns):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({c: _plain(v) for c, v in zip(columns, row)}))
+        if len(lines) == FLUSH_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of text chunks into a gzip stream as they are produced."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class OrderExport:
+    """Streams order lines from a server-side cursor as CSV or JSONL, optionally gzipped."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ORDER_EXPORT_BATCH", 1000)
+        app.config.setdefault("ORDER_EXPORT_TOKEN", None)
+        app.extensions['order_export'] = self
+
+        @app.cli.command('export-orders')
+        @click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv')
+        @click.option('--start', help="First day (YYYY-MM-DD), inclusive.")
+        @click.option('--end', help="Last day (YYYY-MM-DD), inclusive.")
+        @click.option('--customer-id', type=int)
+        @click.option('--email')
+        @click.option('--gzip', 'compress', is_flag=True, help="Write gzip-compressed output.")
+        @click.option('--output', '-o', default='-', help="File to write, or - for stdout.")
+        def export_orders(fmt, start, end, customer_id, email, compress, output):
+            """Export order lines joined with customers and payments."""
+            chunks = self.stream(fmt, parse_day(start, None), parse_day(end, None), customer_id, email, compress)
+            out = sys.stdout.buffer if output == '-' else open(output, 'wb')
+            try:
+                for chunk in chunks:
+                    out.write(chunk if compress else chunk.encode())
+            finally:
+                if out is not sys.stdout.buffer:
+                    out.close()
+
+    def authorized(self, header):
+        """Check an `Authorization: Bearer <ORDER_EXPORT_TOKEN>` header; exports are off without a token."""
+        token = current_app.config["ORDER_EXPORT_TOKEN"]
+        if not token or not header or not header.startswith('Bearer '):
+            return False
+        return hmac.compare_digest(header[len('Bearer '):].encode(), token.encode())
+
+    def rows(self, start=None, end=None, customer_id=None, email=None):
+        """Yield export rows in batches of ORDER_EXPORT_BATCH from a server-side cursor."""
+        batch_size = int(current_app.config["ORDER_EXPORT_BATCH"])
+        result = db.session.execute(
+            export_query(start, end, customer_id, email).execution_options(yield_per=batch_size)
+        )
+        try:
+            yield list(result.keys())
+            yield from result
+        finally:
+            result.close()
+
+    def stream(self, fmt, start=None, end=None, customer_id=None, email=None, compress=False):
+        """Yield the export as text chunks, or gzip bytes if `compress`."""
+        rows = self.rows(start, end, customer_id, email)
+        columns = next(rows)
+        chunks = WRITERS[fmt](rows, columns)
+        return gzip_chunks(chunks) if compress else chunks
+
+
+order_export = OrderExport()
@@ -0,0 +1,308 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+import click
+from flask import current_app
+from sqlalchemy import and_, insert, or_, select, update
+from db import db, Products, Sales, SaleDetails, Payments, OrderIntents
+from customers import customer_resolver
+from inventory import inventory
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class LostClaim(Exception):
+    """The intent was taken over by another worker after this worker's lease ran out."""
+
+
+class _Workers:
+    """One app's order worker threads."""
+
+    def __init__(self):
+        self.stop = threading.Event()
+        self.threads = []
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+
+class OrderPipeline:
+    """Asynchronous checkout through a table-backed outbox of order intents.
+
+    With ORDER_PIPELINE = 'async', checkout reserves stock and records the
+    validated order in `order_intents` in one short transaction, then answers
+    with the intent's `order_ref`. Workers (`flask order-workers`, or
+    ORDER_WORKERS_IN_PROCESS threads) claim pending intents in batches and
+    write the `Sales`, `SaleDetails` and `Payments` rows for each.
+
+    A claim is a lease: an intent whose worker died is claimed again once
+    ORDER_LEASE_SECONDS pass. Completion is guarded on the claim token, so an
+    intent retried by two workers produces exactly one sale. Intents that keep
+    failing are marked failed after ORDER_MAX_ATTEMPTS and their stock is
+    put back.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ORDER_PIPELINE", "sync")
+        app.config.setdefault("ORDER_BATCH_SIZE", 50)
+        app.config.setdefault("ORDER_LEASE_SECONDS", 60)
+        app.config.setdefault("ORDER_MAX_ATTEMPTS", 5)
+        app.config.setdefault("ORDER_POLL_INTERVAL", 0.5)
+        app.config.setdefault("ORDER_WORKERS_IN_PROCESS", 0)
+        if app.config["ORDER_PIPELINE"] not in ('sync', 'async'):
+            raise ValueError(f"Unknown ORDER_PIPELINE {app.config['ORDER_PIPELINE']!r}")
+        workers = app.extensions['order_pipeline'] = _Workers()
+
+        @app.cli.command('order-workers')
+        @click.option('--workers', 'count', type=int, default=2, help="Worker threads claiming batches concurrently.")
+        @click.option('--once', is_flag=True, help="Drain the queue and exit instead of polling.")
+        def order_workers(count, once):
+            """Turn queued order intents into sales."""
+            if once:
+                processed = 0
+                while True:
+                    done = self.process_batch()
+                    if done is None:
+                        break
+                    processed += done
+                logger.info(f"Processed {processed} queued orders")
+                return
+            self.start(app, count)
+            logger.info(f"Started {count} order workers")
+            try:
+                while any(thread.is_alive() for thread in workers.threads):
+                    workers.stop.wait(1)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.stop(app)
+
+        in_process = int(app.config["ORDER_WORKERS_IN_PROCESS"])
+        if app.config["ORDER_PIPELINE"] == 'async' and in_process:
+            # Started by each process's first request, so an app preloaded before forking has no threads
+            app.before_request(lambda: self._start_in_process(app, in_process))
+
+    @property
+    def enabled(self):
+        return current_app.config["ORDER_PIPELINE"] == 'async'
+
+    @property
+    def batch_size(self):
+        return int(current_app.config["ORDER_BATCH_SIZE"])
+
+    @property
+    def lease(self):
+        return timedelta(seconds=int(current_app.config["ORDER_LEASE_SECONDS"]))
+
+    @property
+    def max_attempts(self):
+        return int(current_app.config["ORDER_MAX_ATTEMPTS"])
+
+    def new_order_ref(self):
+        """Return a public order id for an order about to be queued; its stock is reserved under it."""
+        return str(uuid.uuid4())
+
+    def submit(self, order_ref, payload):
+        """Queue an order intent under `order_ref` in the current transaction.
+
+        The caller commits, together with the stock it reserved for the order.
+        """
+        db.session.execute(insert(OrderIntents).values(order_ref=order_ref, status=PENDING, payload=payload))
+
+    def status(self, order_ref):
+        """Return the intent's status and sale id as a dict, or None for an unknown id.
+
+        Failure details stay in `order_intents.error` for operators.
+        """
+        row = db.session.execute(
+            select(OrderIntents.status, OrderIntents.sale_id)
+            .where(OrderIntents.order_ref == order_ref)
+        ).first()
+        if row is None:
+            return None
+        return {'status': row.status, 'sale_id': row.sale_id}
+
+    def _claimable(self, now):
+        return or_(
+            OrderIntents.status == PENDING,
+            and_(OrderIntents.status == PROCESSING, OrderIntents.locked_until < now)
+        )
+
+    def _claim(self, limit):
+        """Lease up to `limit` intents to a new claim token; returns (token, intents)."""
+        now = datetime.utcnow()
+        token = str(uuid.uuid4())
+        # SKIP LOCKED lets concurrent workers take disjoint batches on Postgres; the
+        # repeated status guard in the UPDATE is what keeps claims exclusive elsewhere
+        candidates = db.session.execute(
+            select(OrderIntents.id).where(self._claimable(now))
+            .order_by(OrderIntents.id).limit(limit).with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not candidates:
+            db.session.commit()
+            return token, []
+        claimed = db.session.execute(
+            update(OrderIntents)
+            .where(OrderIntents.id.in_(candidates), self._claimable(now))
+            .values(status=PROCESSING, claimed_by=token, locked_until=now + self.lease,
+                    attempts=OrderIntents.attempts + 1)
+            .returning(OrderIntents.id, OrderIntents.order_ref, OrderIntents.payload, OrderIntents.attempts)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        return token, sorted(claimed, key=lambda intent: intent.id)
+
+    def _materialize(self, order_ref, payload):
+        """Write the sale, its lines and its payment for an intent; returns (sale id, customer id)."""
+        customer = payload['customer']
+        customer_id = customer_resolver.resolve(
+            email=customer['email'],
+            full_name=customer['full_name'],
+            phone_no=customer['phone_no']
+        )
+        # Stamped when written, not with the checkout time in the payload: the rollups'
+        # settle window assumes a sale's timestamp is no older than its transaction
+        sale = Sales(
+            customer_id=customer_id,
+            total_amount=Decimal(payload['total']),
+            created_at=datetime.utcnow()
+        )
+        db.session.add(sale)
+        db.session.flush()
+        db.session.execute(insert(SaleDetails), [
+            {
+                'sale_id': sale.sale_id,
+                'product_id': line['product_id'],
+                'quantity': line['quantity'],
+                'purchase_amount': Decimal(line['amount'])
+            } for line in payload['lines']
+        ])
+        db.session.add(Payments(
+            sale_id=sale.sale_id,
+            customer_id=customer_id,
+            payment_method=payload['payment_method'],
+            amount=Decimal(payload['total'])
+        ))
+        db.session.flush()
+        for product_id in payload['sharded']:
+            inventory.attach(order_ref, product_id, sale.sale_id)
+        return sale.sale_id, customer_id
+
+    def _restock(self, order_ref, payload):
+        """Put back the stock checkout reserved for an intent that will never become a sale."""
+        sharded = set(payload['sharded'])
+        for product_id, quantity in sorted(payload['stock']):
+            if product_id in sharded:
+                inventory.cancel(order_ref, product_id)
+            else:
+                db.session.execute(
+                    update(Products).where(Products.product_id == product_id)
+                    .values(stock_quantity=Products.stock_quantity + quantity)
+                    .execution_options(synchronize_session=False)
+                )
+
+    def _give_up_or_retry(self, intent, token, error):
+        final = intent.attempts >= self.max_attempts
+        with db.session.begin_nested():
+            moved = db.session.execute(
+                update(OrderIntents)
+                .where(OrderIntents.id == intent.id, OrderIntents.claimed_by == token,
+                       OrderIntents.status == PROCESSING)
+                .values(status=FAILED if final else PENDING, error=error[:255], locked_until=None)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if moved and final:
+                self._restock(intent.order_ref, intent.payload)
+        if moved and final:
+            logger.error(f"Order {intent.order_ref} failed after {intent.attempts} attempts: {error}")
+
+    def process_batch(self, limit=None):
+        """Claim and materialize one batch of intents in a single transaction.
+
+        Returns the number of orders completed, or None when nothing was
+        waiting. Each intent runs in its own savepoint, so one bad order only
+        rolls back itself.
+        """
+        token, intents = self._claim(limit or self.batch_size)
+        if not intents:
+            return None
+        completed, customers = 0, []
+        for intent in intents:
+            try:
+                with db.session.begin_nested():
+                    sale_id, customer_id = self._materialize(intent.order_ref, intent.payload)
+                    done = db.session.execute(
+                        update(OrderIntents)
+                        .where(OrderIntents.id == intent.id, OrderIntents.claimed_by == token,
+                               OrderIntents.status == PROCESSING)
+                        .values(status=COMPLETED, sale_id=sale_id, error=None, locked_until=None)
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+                    if not done:
+                        raise LostClaim()
+                completed += 1
+                customers.append((intent.payload['customer']['email'], customer_id))
+            except LostClaim:
+                logger.warning(f"Order {intent.order_ref} was reclaimed by another worker; skipping")
+            except Exception as e:
+                logger.error(f"Error materializing order {intent.order_ref}: {str(e)}")
+                self._give_up_or_retry(intent, token, str(e))
+        db.session.commit()
+        for email, customer_id in customers:
+            customer_resolver.remember(email, customer_id)
+        logger.info(f"Materialized {completed} of {len(intents)} queued orders")
+        return completed
+
+    def _work(self, app):
+        workers = app.extensions['order_pipeline']
+        with app.app_context():
+            poll_interval = float(app.config["ORDER_POLL_INTERVAL"])
+            while not workers.stop.is_set():
+                try:
+                    done = self.process_batch()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Order worker error: {str(e)}")
+                    done = None
+                if done is None:
+                    workers.stop.wait(poll_interval)
+
+    def _start_in_process(self, app, count):
+        workers = app.extensions['order_pipeline']
+        if workers.pid == os.getpid():
+            return
+        with workers.start_lock:
+            if workers.pid != os.getpid():
+                workers.pid = os.getpid()
+                workers.threads = []
+                self.start(app, count)
+
+    def start(self, app, count):
+        """Start `count` daemon threads for `app`, each with its own app context and session."""
+        workers = app.extensions['order_pipeline']
+        workers.stop.clear()
+        for i in range(count):
+            thread = threading.Thread(target=self._work, args=(app,), name=f"order-worker-{i}", daemon=True)
+            thread.start()
+            workers.threads.append(thread)
+
+    def stop(self, app, timeout=10):
+        workers = app.extensions['order_pipeline']
+        workers.stop.set()
+        for thread in workers.threads:
+            thread.join(timeout)
+        workers.threads = []
+
+
+order_pipeline = OrderPipeline()
@@ -0,0 +1,86 @@
+import base64
+import binascii
+import json
+from sqlalchemy import tuple_
+from werkzeug.exceptions import BadRequest
+
+
+def encode_token(payload):
+    """Encode a JSON-serializable payload as an opaque, URL-safe token."""
+    raw = json.dumps(payload, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Decode a token produced by `encode_token`; raises BadRequest if malformed."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError):
+        raise BadRequest("Invalid cursor")
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query, with cursors to its neighbours."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, keys, per_page, cursor=None, descending=False, signature=''):
+    """Seek-paginate a legacy `Query` instead of using OFFSET.
+
+    `keys` is a list of `(expression, coerce)` pairs that uniquely orders the
+    rows (end with the primary key); `coerce` turns a value read back from a
+    cursor into the type the expression compares against. All keys sort in the
+    same direction. `signature` ties cursors to the sort/filter they came from.
+    """
+    values = None
+    backwards = False
+    if cursor:
+        payload = decode_token(cursor)
+        if not isinstance(payload, dict) or payload.get('s') != signature \
+                or not isinstance(payload.get('k'), list) or len(payload['k']) != len(keys):
+            raise BadRequest("Invalid cursor")
+        try:
+            values = [coerce(v) for (_, coerce), v in zip(keys, payload['k'])]
+        except (TypeError, ValueError, ArithmeticError):
+            raise BadRequest("Invalid cursor")
+        backwards = payload.get('d') == 'prev'
+
+    # Walking backwards flips the order; results are reversed afterwards
+    ascending = descending == backwards
+    expressions = [expression for expression, _ in keys]
+    query = query.order_by(None).order_by(*(e.asc() if ascending else e.desc() for e in expressions))
+    if values is not None:
+        position = tuple_(*expressions)
+        query = query.filter(position > tuple_(*values) if ascending else position < tuple_(*values))
+    query = query.add_columns(*(e.label(f'_seek{i}') for i, e in enumerate(expressions)))
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def token(row, direction):
+        return encode_token({'s': signature, 'd': direction, 'k': list(row[1:])})
+
+    has_next = has_more if not backwards else values is not None
+    has_prev = values is not None if not backwards else has_more
+    return KeysetPage(
+        items=[row[0] for row in rows],
+        next_cursor=token(rows[-1], 'next') if rows and has_next else None,
+        prev_cursor=token(rows[0], 'prev') if rows and has_prev else None
+    )
@@ -0,0 +1,74 @@
+import json
+from decimal import Decimal
+from sqlalchemy import select
+from werkzeug.exceptions import BadRequest
+from db import Products
+from pagination import encode_token, decode_token
+
+# Public field name -> (column, serializer). `id` is always selected because the
+# pagination cursor is keyed on it.
+PRODUCT_FIELDS = {
+    'id': (Products.product_id, lambda v: v),
+    'name': (Products.product_name, lambda v: v),
+    'price': (Products.selling_price, float),
+    'image': (Products.image, lambda v: v),
+    'category': (Products.category, lambda v: v),
+    'rating': (Products.rating, lambda v: float(v) if v is not None else 4.5),
+    'description': (Products.description, lambda v: v or "No description available"),
+}
+
+
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+def parse_fields(raw):
+    """Parse a `fields=` query value into a tuple of known field names."""
+    if not raw:
+        return tuple(PRODUCT_FIELDS)
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+    if unknown or not fields:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown) or raw}")
+    return fields
+
+
+def encode_cursor(product_id):
+    """Return an opaque cursor pointing just after `product_id`."""
+    return encode_token({'after': product_id})
+
+
+def decode_cursor(token):
+    """Return the product id encoded in a cursor produced by `encode_cursor`."""
+    payload = decode_token(token)
+    after = payload.get('after') if isinstance(payload, dict) else None
+    if not isinstance(after, int):
+        raise BadRequest("Invalid cursor")
+    return after
+
+
+def build_query(fields, after_id=None, limit=None):
+    """Select only the requested columns, ordered by product id."""
+    columns = [Products.product_id] + [PRODUCT_FIELDS[f][0] for f in fields if f != 'id']
+    query = select(*columns).order_by(Products.product_id)
+    if after_id is not None:
+        query = query.where(Products.product_id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def serialize(row, fields):
+    """Convert a result row from `build_query` into a JSON-ready dict."""
+    mapping = row._mapping
+    return {f: PRODUCT_FIELDS[f][1](mapping[PRODUCT_FIELDS[f][0]]) for f in fields}
+
+
+def stream_json_array(items):
+    """Yield a JSON array chunk by chunk from an iterable of dicts."""
+    yield '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + json.dumps(item, default=_json_default)
+    yield ']'
@@ -0,0 +1,230 @@
+import heapq
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import permutations
+import click
+from flask import current_app
+from sqlalchemy import delete, select
+from db import db, Products, SaleDetails, CoPurchases, ProductRecommendations
+from db_helpers import UPSERT_DIALECTS, advance_sale_watermark, next_sale_batch, sale_watermark
+from catalog_cache import catalog_cache
+from products_api import PRODUCT_FIELDS, serialize
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = 'co_purchases'
+CHUNK = 500  # Product ids per IN (...) list
+_scipy = None
+
+
+def _load_scipy():
+    """Return `(numpy, scipy.sparse)`, or None without them (pairs are then counted in pure Python).
+
+    Imported on first use rather than with the app, since they take longer to
+    import than the rest of it.
+    """
+    global _scipy
+    if _scipy is None:
+        try:
+            import numpy
+            from scipy import sparse
+            _scipy = (numpy, sparse)
+        except ImportError:
+            _scipy = ()
+    return _scipy or None
+
+
+def co_occurrence(rows):
+    """Count, for each ordered pair of distinct products, the sales containing both.
+
+    `rows` are `(sale_id, product_id)` pairs. Returns `{(product_id, related_id): sales}`.
+    With SciPy this is `B.T @ B` over the binary sale x product matrix `B`.
+    """
+    if not rows:
+        return {}
+    modules = _load_scipy()
+    if modules is not None:
+        np, sparse = modules
+        data = np.asarray(rows, dtype=np.int64)
+        _, sale_index = np.unique(data[:, 0], return_inverse=True)
+        products, product_index = np.unique(data[:, 1], return_inverse=True)
+        baskets = sparse.csr_matrix(
+            (np.ones(len(data), dtype=np.int32), (sale_index, product_index)),
+            shape=(sale_index.max() + 1, len(products))
+        )
+        baskets.data[:] = 1  # A product on several lines of one sale counts once
+        pairs = (baskets.T @ baskets).tocoo()
+        off_diagonal = pairs.row != pairs.col
+        return dict(zip(
+            zip(products[pairs.row[off_diagonal]].tolist(), products[pairs.col[off_diagonal]].tolist()),
+            pairs.data[off_diagonal].tolist()
+        ))
+    baskets = defaultdict(set)
+    for sale_id, product_id in rows:
+        baskets[sale_id].add(product_id)
+    counts = Counter()
+    for basket in baskets.values():
+        counts.update(permutations(basket, 2))
+    return dict(counts)
+
+
+def _chunks(values, size=CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class CoPurchaseRecommendations:
+    """"Frequently bought together" lists precomputed from `SaleDetails`.
+
+    `refresh()` folds sales above a high-water mark (kept in `RollupState`,
+    like the sales rollups) into the pair counts in `co_purchases`, then
+    rewrites the top RECOMMENDATIONS_TOP_K rows in `product_recommendations`
+    for just the products those sales touched. Requests only read the
+    precomputed rows, through the catalog cache.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RECOMMENDATIONS_TOP_K", 10)
+        app.config.setdefault("RECOMMENDATIONS_BATCH_SIZE", 5000)
+        app.config.setdefault("RECOMMENDATIONS_SETTLE_SECONDS", 60)
+        app.extensions['recommendations'] = self
+
+        @app.cli.command('refresh-recommendations')
+        def refresh_recommendations():
+            """Fold sales recorded since the last run into the co-purchase recommendations."""
+            processed = self.refresh()
+            logger.info(f"Updated recommendations from {processed} sales")
+
+        @app.cli.command('rebuild-recommendations')
+        @click.option('--batch-size', type=int, default=None, help="Sales folded in per transaction.")
+        def rebuild_recommendations(batch_size):
+            """Rebuild co-purchase counts and recommendations from all sales."""
+            processed = self.rebuild(batch_size)
+            logger.info(f"Rebuilt recommendations from {processed} sales")
+
+    @property
+    def top_k(self):
+        return int(current_app.config["RECOMMENDATIONS_TOP_K"])
+
+    @property
+    def batch_size(self):
+        return int(current_app.config["RECOMMENDATIONS_BATCH_SIZE"])
+
+    @property
+    def settle(self):
+        return timedelta(seconds=int(current_app.config["RECOMMENDATIONS_SETTLE_SECONDS"]))
+
+    def _add_pairs(self, pairs):
+        """Add pair counts onto `co_purchases`, creating missing rows."""
+        rows = [{'product_id': p, 'related_id': r, 'orders': n} for (p, r), n in pairs.items()]
+        if not rows:
+            return
+        insert = UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+        if insert is not None:
+            table = CoPurchases.__table__
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.product_id, table.c.related_id],
+                set_={'orders': table.c.orders + stmt.excluded.orders}
+            )
+            db.session.execute(stmt, rows)
+            return
+        for row in rows:
+            existing = db.session.get(CoPurchases, (row['product_id'], row['related_id']))
+            if existing is None:
+                db.session.add(CoPurchases(**row))
+            else:
+                existing.orders += row['orders']
+
+    def _rank(self, product_ids):
+        """Rewrite the top-K rows of `product_ids` from their current pair counts."""
+        top_k = self.top_k
+        for chunk in _chunks(sorted(product_ids)):
+            neighbours = defaultdict(list)
+            for row in db.session.execute(
+                select(CoPurchases.product_id, CoPurchases.related_id, CoPurchases.orders)
+                .where(CoPurchases.product_id.in_(chunk))
+            ):
+                neighbours[row.product_id].append((row.orders, -row.related_id))
+            db.session.execute(delete(ProductRecommendations).where(ProductRecommendations.product_id.in_(chunk)))
+            rows = [
+                {'product_id': product_id, 'rank': rank, 'related_id': -negated_id, 'score': orders}
+                for product_id, candidates in neighbours.items()
+                # Most sales together first; ties go to the lower product id
+                for rank, (orders, negated_id) in enumerate(heapq.nlargest(top_k, candidates))
+            ]
+            if rows:
+                db.session.execute(ProductRecommendations.__table__.insert(), rows)
+
+    def refresh(self, batch_size=None):
+        """Fold unprocessed, settled sales into the recommendations; returns the number of sales processed."""
+        batch_size = batch_size or self.batch_size
+        processed = 0
+        while True:
+            lower = sale_watermark(STATE_NAME).last_sale_id
+            upper, count = next_sale_batch(lower, batch_size, self.settle)
+            if upper is None:
+                db.session.commit()
+                break
+            if not advance_sale_watermark(STATE_NAME, lower, upper):
+                db.session.rollback()
+                logger.info("Recommendations already advanced by another worker")
+                break
+            rows = db.session.execute(
+                select(SaleDetails.sale_id, SaleDetails.product_id)
+                .where(SaleDetails.sale_id.between(lower + 1, upper)).distinct()
+            ).all()
+            pairs = co_occurrence([tuple(row) for row in rows])
+            self._add_pairs(pairs)
+            self._rank({product_id for product_id, _ in pairs})
+            db.session.commit()
+            processed += count
+            logger.info(f"Counted co-purchases in sales {lower + 1}..{upper} ({len(pairs)} pairs)")
+        return processed
+
+    def rebuild(self, batch_size=None):
+        """Clear the pair counts and recommendations and rebuild them from the first sale onwards."""
+        db.session.execute(delete(ProductRecommendations))
+        db.session.execute(delete(CoPurchases))
+        state = sale_watermark(STATE_NAME)
+        state.last_sale_id = 0
+        state.updated_at = datetime.utcnow()
+        db.session.commit()
+        return self.refresh(batch_size)
+
+    def for_product(self, product_id, limit=None):
+        """Return up to `limit` product dicts (as served by /products) bought together with `product_id`."""
+        top_k = self.top_k
+        limit = min(limit or top_k, top_k)
+
+        def load():
+            fields = tuple(PRODUCT_FIELDS)
+            rows = db.session.execute(
+                select(*(column for column, _ in PRODUCT_FIELDS.values()), ProductRecommendations.score)
+                .join(ProductRecommendations, ProductRecommendations.related_id == Products.product_id)
+                .where(ProductRecommendations.product_id == product_id)
+                .order_by(ProductRecommendations.rank)
+            ).all()
+            return [dict(serialize(row, fields), score=row.score) for row in rows]
+        return catalog_cache.get_or_load(('recommendations', product_id), load)[:limit]
+
+    def for_cart(self, product_ids, limit=4):
+        """Combine the recommendations of every product in a cart, leaving out what is already in it."""
+        in_cart = set(product_ids)
+        scores, products = Counter(), {}
+        for product_id in in_cart:
+            for product in self.for_product(product_id):
+                if product['id'] not in in_cart:
+                    scores[product['id']] += product['score']
+                    products[product['id']] = product
+        ranked = sorted(scores, key=lambda product_id: (-scores[product_id], product_id))[:limit]
+        return [dict(products[product_id], score=scores[product_id]) for product_id in ranked]
+
+
+recommendations = CoPurchaseRecommendations()
@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import click
+from flask import current_app
+from sqlalchemy import delete, func, select
+from werkzeug.exceptions import BadRequest
+from db import (db, Products, Sales, SaleDetails, Payments,
+                DailyProductSales, DailyCategorySales, DailyPaymentSales, RollupState)
+from db_helpers import UPSERT_DIALECTS, advance_sale_watermark, next_sale_batch, sale_watermark
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = 'sales'
+
+# Rollup model -> (key columns, additive measure columns)
+ROLLUPS = {
+    DailyProductSales: (('day', 'product_id'), ('units', 'revenue', 'cost')),
+    DailyCategorySales: (('day', 'category'), ('units', 'revenue')),
+    DailyPaymentSales: (('day', 'payment_method'), ('payments', 'amount')),
+}
+
+
+def _as_date(value):
+    # SQLite's date() returns text, Postgres returns a date
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def parse_day(value, default):
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f"Invalid date: {value}")
+
+
+class _RefreshClock:
+    """When one app last refreshed the rollups, for `refresh_if_stale`."""
+
+    def __init__(self):
+        self.last = 0.0
+        self.lock = threading.Lock()
+
+
+class SalesRollups:
+    """Daily sales rollups maintained from a high-water mark on `Sales.sale_id`.
+
+    Each refresh folds only sales above `RollupState.last_sale_id` into the
+    rollup tables and advances the mark in the same transaction, so every
+    sale is counted exactly once. Sales newer than ROLLUP_SETTLE_SECONDS are
+    left for the next run, so an order whose transaction commits after a
+    later sale id is not skipped.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ROLLUP_BATCH_SIZE", 5000)
+        app.config.setdefault("ROLLUP_SETTLE_SECONDS", 60)
+        app.config.setdefault("ROLLUP_REFRESH_INTERVAL", 60)
+        app.extensions['sales_rollups'] = _RefreshClock()
+
+        @app.cli.command('rollup-sales')
+        def rollup_sales():
+            """Fold sales recorded since the last run into the rollup tables."""
+            processed = self.refresh()
+            logger.info(f"Rolled up {processed} sales")
+
+        @app.cli.command('backfill-rollups')
+        @click.option('--batch-size', type=int, default=None, help="Sales folded in per transaction.")
+        def backfill_rollups(batch_size):
+            """Rebuild the rollup tables from all sales, in batches."""
+            processed = self.backfill(batch_size)
+            logger.info(f"Backfilled rollups from {processed} sales")
+
+    @property
+    def batch_size(self):
+        return int(current_app.config["ROLLUP_BATCH_SIZE"])
+
+    @property
+    def settle(self):
+        return timedelta(seconds=int(current_app.config["ROLLUP_SETTLE_SECONDS"]))
+
+    def _aggregate(self, lower, upper):
+        in_range = Sales.sale_id.between(lower + 1, upper)
+        day = func.date(Sales.created_at).label('day')
+        product_rows = db.session.execute(
+            select(
+                day, SaleDetails.product_id, func.coalesce(Products.category, '').label('category'),
+                func.sum(SaleDetails.quantity).label('units'),
+                func.sum(SaleDetails.purchase_amount).label('revenue'),
+                func.sum(SaleDetails.quantity * Products.buying_price).label('cost')
+            )
+            .join(Sales, Sales.sale_id == SaleDetails.sale_id)
+            .join(Products, Products.product_id == SaleDetails.product_id)
+            .where(in_range)
+            .group_by(day, SaleDetails.product_id, Products.category)
+        ).all()
+        payment_rows = db.session.execute(
+            select(day, Payments.payment_method, func.count().label('payments'), func.sum(Payments.amount).label('amount'))
+            .join(Sales, Sales.sale_id == Payments.sale_id)
+            .where(in_range)
+            .group_by(day, Payments.payment_method)
+        ).all()
+
+        products = [
+            {'day': _as_date(r.day), 'product_id': r.product_id, 'units': r.units, 'revenue': r.revenue, 'cost': r.cost}
+            for r in product_rows
+        ]
+        # Category totals are derived from the product rows rather than scanning the orders again
+        categories = defaultdict(lambda: {'units': Decimal(0), 'revenue': Decimal(0)})
+        for r in product_rows:
+            totals = categories[(_as_date(r.day), r.category)]
+            totals['units'] += Decimal(r.units)
+            totals['revenue'] += Decimal(r.revenue)
+        payments = [
+            {'day': _as_date(r.day), 'payment_method': r.payment_method, 'payments': r.payments, 'amount': r.amount}
+            for r in payment_rows
+        ]
+        return {
+            DailyProductSales: products,
+            DailyCategorySales: [{'day': d, 'category': c, **totals} for (d, c), totals in categories.items()],
+            DailyPaymentSales: payments,
+        }
+
+    def _add(self, model, rows):
+        """Add `rows` onto the existing rollup rows, creating any that are missing."""
+        if not rows:
+            return
+        keys, measures = ROLLUPS[model]
+        insert = UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+        if insert is not None:
+            table = model.__table__
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c[key] for key in keys],
+                set_={m: table.c[m] + stmt.excluded[m] for m in measures}
+            )
+            db.session.execute(stmt, rows)
+            return
+        for row in rows:
+            existing = db.session.get(model, tuple(row[key] for key in keys))
+            if existing is None:
+                db.session.add(model(**row))
+            else:
+                for m in measures:
+                    setattr(existing, m, getattr(existing, m) + row[m])
+
+    def refresh(self, batch_size=None, max_batches=None):
+        """Fold unprocessed, settled sales into the rollups; returns the number of sales processed."""
+        batch_size = batch_size or self.batch_size
+        processed = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            lower = sale_watermark(STATE_NAME).last_sale_id
+            upper, count = next_sale_batch(lower, batch_size, self.settle)
+            if upper is None:
+                db.session.commit()
+                break
+            # Advance the mark first, guarded on its old value: a concurrent refresh that
+            # got there first leaves nothing to update and this one backs off
+            if not advance_sale_watermark(STATE_NAME, lower, upper):
+                db.session.rollback()
+                logger.info("Sales rollup already advanced by another worker")
+                break
+            for model, rows in self._aggregate(lower, upper).items():
+                self._add(model, rows)
+            db.session.commit()
+            processed += count
+            batches += 1
+            logger.info(f"Rolled up sales {lower + 1}..{upper}")
+        current_app.extensions['sales_rollups'].last = time.monotonic()
+        return processed
+
+    def refresh_if_stale(self):
+        """Opportunistic refresh for read endpoints, at most once per ROLLUP_REFRESH_INTERVAL per process."""
+        clock = current_app.extensions['sales_rollups']
+        interval = int(current_app.config["ROLLUP_REFRESH_INTERVAL"])
+        if interval <= 0 or time.monotonic() - clock.last < interval:
+            return
+        if not clock.lock.acquire(blocking=False):
+            return
+        try:
+            self.refresh(max_batches=1)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Sales rollup refresh failed: {str(e)}")
+        finally:
+            clock.lock.release()
+
+    def backfill(self, batch_size=None):
+        """Clear the rollups and rebuild them from the first sale onwards."""
+        for model in ROLLUPS:
+            db.session.execute(delete(model))
+        state = sale_watermark(STATE_NAME)
+        state.last_sale_id = 0
+        state.updated_at = datetime.utcnow()
+        db.session.commit()
+        return self.refresh(batch_size)
+
+    def watermark(self):
+        state = db.session.get(RollupState, STATE_NAME)
+        return {
+            'last_sale_id': state.last_sale_id if state else 0,
+            'updated_at': state.updated_at.isoformat() if state and state.updated_at else None
+        }
+
+    def report(self, model, start, end, by_day=False, filters=None):
+        """Sum a rollup's measures over [start, end], per key and optionally per day."""
+        keys, measures = ROLLUPS[model]
+        group = [getattr(model, key) for key in keys if key != 'day' or by_day]
+        query = select(*group, *(func.sum(getattr(model, m)).label(m) for m in measures)) \
+            .where(model.day.between(start, end))
+        for column, value in (filters or {}).items():
+            query = query.where(getattr(model, column) == value)
+        order = [model.day] if by_day else []
+        query = query.group_by(*group).order_by(*order, func.sum(getattr(model, measures[1])).desc())
+        return [dict(row._mapping) for row in db.session.execute(query)]
+
+
+sales_rollups = SalesRollups()
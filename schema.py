@@ -0,0 +1,124 @@
+import logging
+import click
+from sqlalchemy import insert, inspect, select
+from db import db, SchemaMigrations
+
+logger = logging.getLogger(__name__)
+
+
+def create_indexes(*names):
+    """Migration step creating the named indexes declared in db.py, skipping any that already exist."""
+    def migrate(connection):
+        indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+        inspector = inspect(connection)
+        for name in names:
+            index = indexes[name]
+            if not inspector.has_table(index.table.name):
+                continue  # Created whole, with the index, by `flask init-db`
+            if any(existing['name'] == name for existing in inspector.get_indexes(index.table.name)):
+                continue
+            index.create(connection)
+            logger.info(f"Created index {name} on {index.table.name}")
+    return migrate
+
+
+def create_tables(*names):
+    """Migration step creating the named tables declared in db.py (with their indexes) if they are missing."""
+    def migrate(connection):
+        for name in names:
+            db.metadata.tables[name].create(connection, checkfirst=True)
+    return migrate
+
+
+def add_columns(table, *names):
+    """Migration step adding the named columns declared in db.py to an existing table, skipping any it has."""
+    def migrate(connection):
+        inspector = inspect(connection)
+        if not inspector.has_table(table):
+            return  # Created whole, with the columns, by `flask init-db`
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name in names:
+            if name in existing:
+                continue
+            column = db.metadata.tables[table].c[name]
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table} ADD COLUMN {name} {column.type.compile(dialect=connection.dialect)}"
+            )
+            logger.info(f"Added column {name} to {table}")
+    return migrate
+
+
+# Applied in order by `flask migrate`; append new steps, never edit or reorder applied ones
+MIGRATIONS = (
+    ('0001_hot_path_indexes', create_indexes(
+        'ix_products_category_id', 'ix_products_category_price', 'ix_products_category_name',
+        'ix_products_price', 'ix_products_name',
+        'ix_sales_created_at', 'ix_sales_customer_id',
+        'ix_sale_details_sale_id', 'ix_sale_details_product_id',
+        'ix_payments_sale_id'
+    )),
+    ('0002_catalog_versions', create_tables('catalog_versions')),
+    ('0003_stock_reservations_order_ref', add_columns('stock_reservations', 'order_ref')),
+    ('0004_stock_reservations_order_ref_index', create_indexes('ix_stock_reservations_order_ref')),
+)
+
+
+class Migrations:
+    """Ordered schema changes for databases created before the models that need them.
+
+    `db.create_all()` builds new tables with every index declared in db.py but
+    never alters a table that already exists. `flask migrate` brings such a
+    database up to date by running the MIGRATIONS steps not yet recorded in
+    `schema_migrations`, each in its own transaction. Steps are idempotent, so
+    on a freshly created database they are only recorded. Plain CREATE INDEX
+    blocks writes to the table while it builds; migrate a large Postgres
+    database off-peak.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['migrations'] = self
+
+        @app.cli.command('init-db')
+        def init_db():
+            """Create missing tables (with their indexes) and apply pending migrations."""
+            db.create_all()
+            applied = self.upgrade()
+            logger.info(f"Database schema created; {len(applied)} migrations recorded")
+
+        @app.cli.command('migrate')
+        @click.option('--list', 'show', is_flag=True, help="List pending migrations without running them.")
+        def migrate(show):
+            """Apply pending schema migrations."""
+            if show:
+                for name in self.pending():
+                    click.echo(name)
+                return
+            applied = self.upgrade()
+            logger.info(f"Applied {len(applied)} migrations" + (f": {', '.join(applied)}" if applied else ""))
+
+    def pending(self):
+        """Return the names of migrations not yet applied to the database."""
+        SchemaMigrations.__table__.create(db.engine, checkfirst=True)
+        applied = set(db.session.scalars(select(SchemaMigrations.name)))
+        db.session.rollback()
+        return [name for name, _ in MIGRATIONS if name not in applied]
+
+    def upgrade(self):
+        """Run pending migrations in order; returns the names applied."""
+        pending = set(self.pending())
+        applied = []
+        for name, step in MIGRATIONS:
+            if name not in pending:
+                continue
+            with db.engine.begin() as connection:
+                step(connection)
+                connection.execute(insert(SchemaMigrations).values(name=name))
+            applied.append(name)
+        return applied
+
+
+migrations = Migrations()
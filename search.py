@@ -0,0 +1,240 @@
+import bisect
+import logging
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import Numeric, case, cast, func, literal, or_, select, text
+from db import db, Products, product_search_document
+from catalog_cache import SEARCH, catalog_cache
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Field weights, matching ts_rank's defaults for setweight 'A', 'B' and 'C'
+FIELD_WEIGHTS = (('product_name', 1.0), ('category', 0.4), ('description', 0.2))
+SUBSTRING_BONUS = 0.1
+RECENT_QUERIES = 256
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def trigrams(text):
+    """Return the set of character trigrams in `text` (lowercased)."""
+    text = (text or '').lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class InMemorySearchIndex:
+    """Inverted index over product name, category and description.
+
+    Every query token is prefix-matched against the vocabulary (like a
+    `term:*` tsquery) and all tokens must match. Product names also get a
+    trigram index so plain substring matches, as served by pg_trgm, still hit.
+    """
+
+    def __init__(self, rows):
+        self._postings = defaultdict(dict)  # term -> {product_id: weight}
+        self._trigrams = defaultdict(set)  # trigram -> {product_id}
+        self._names = {}
+        for row in rows:
+            self._names[row.product_id] = row.product_name or ''
+            for field, weight in FIELD_WEIGHTS:
+                for term in tokenize(getattr(row, field)):
+                    postings = self._postings[term]
+                    postings[row.product_id] = postings.get(row.product_id, 0.0) + weight
+            for gram in trigrams(row.product_name):
+                self._trigrams[gram].add(row.product_id)
+        self._vocabulary = sorted(self._postings)
+        self._recent = OrderedDict()  # term -> ranked results, shared by filter and sort
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def _prefix_scores(self, token):
+        scores = {}
+        start = bisect.bisect_left(self._vocabulary, token)
+        for term in self._vocabulary[start:]:
+            if not term.startswith(token):
+                break
+            for product_id, weight in self._postings[term].items():
+                scores[product_id] = max(scores.get(product_id, 0.0), weight)
+        return scores
+
+    def _substring_matches(self, term):
+        term = term.lower()
+        if not term:
+            return set()
+        grams = trigrams(term)
+        if grams:
+            candidates = set.intersection(*(self._trigrams.get(g, set()) for g in grams))
+        else:
+            candidates = self._names
+        return {pid for pid in candidates if term in self._names[pid].lower()}
+
+    def search(self, term, limit=None):
+        """Return `[(product_id, score), ...]` ranked best first."""
+        ranked = self._recent.get(term)
+        if ranked is None:
+            ranked = self._rank(term)
+            with self._lock:
+                self._recent[term] = ranked
+                if len(self._recent) > RECENT_QUERIES:
+                    self._recent.popitem(last=False)
+        return ranked[:limit] if limit else ranked
+
+    def _rank(self, term):
+        scores = None
+        for token in tokenize(term):
+            token_scores = self._prefix_scores(token)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {pid: s + token_scores[pid] for pid, s in scores.items() if pid in token_scores}
+        scores = scores or {}
+        for product_id in self._substring_matches(term.strip()):
+            scores[product_id] = scores.get(product_id, 0.0) + SUBSTRING_BONUS
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def name(self, product_id):
+        return self._names.get(product_id)
+
+
+class PostgresSearchBackend:
+    """Full-text search served by the GIN tsvector and trigram indexes in db.py."""
+
+    name = 'postgres'
+
+    def _tsquery(self, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return None
+        return func.to_tsquery(text("'simple'::regconfig"), ' & '.join(f'{t}:*' for t in tokens))
+
+    def _match_and_rank(self, term):
+        document = product_search_document()
+        tsquery = self._tsquery(term)
+        substring = Products.product_name.ilike(f'%{escape_like(term)}%', escape='\\')
+        if tsquery is None:
+            return substring, case((substring, SUBSTRING_BONUS), else_=0.0)
+        condition = or_(document.op('@@')(tsquery), substring)
+        rank = func.ts_rank(document, tsquery) + case((substring, SUBSTRING_BONUS), else_=0.0)
+        return condition, rank
+
+    def relevance_key(self, term):
+        # Rounded to numeric so the value survives a round trip through a cursor
+        _, score = self._match_and_rank(term)
+        return -func.round(cast(score, Numeric), 6), Decimal
+
+    def apply(self, query, term, rank=True):
+        condition, _ = self._match_and_rank(term)
+        query = query.filter(condition)
+        if rank:
+            query = query.order_by(self.relevance_key(term)[0], Products.product_id)
+        return query
+
+    def suggest(self, term, limit):
+        condition, _ = self._match_and_rank(term)
+        rows = db.session.execute(
+            select(Products.product_id, Products.product_name)
+            .where(condition).order_by(self.relevance_key(term)[0], Products.product_id).limit(limit)
+        ).all()
+        return [{'id': r.product_id, 'name': r.product_name} for r in rows]
+
+
+class MemorySearchBackend:
+    """Search served by an InMemorySearchIndex, rebuilt when the searchable columns change.
+
+    The index is kept for as long as the `search` catalog version stands, so
+    price and stock updates (checkouts included) do not rebuild it.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self._index = None  # (search version, InMemorySearchIndex)
+        self._lock = threading.Lock()
+
+    def index(self):
+        version = catalog_cache.version(SEARCH)[0]
+        current = self._index
+        if current is not None and current[0] == version:
+            return current[1]
+        with self._lock:
+            if self._index is None or self._index[0] != version:
+                rows = db.session.execute(select(
+                    Products.product_id, Products.product_name, Products.category, Products.description
+                )).all()
+                logger.info(f"Built in-memory search index over {len(rows)} products")
+                self._index = (version, InMemorySearchIndex(rows))
+            return self._index[1]
+
+    def relevance_key(self, term):
+        positions = {product_id: position for position, (product_id, _) in enumerate(self.index().search(term))}
+        if not positions:
+            return literal(0), int
+        return case(positions, value=Products.product_id), int
+
+    def apply(self, query, term, rank=True):
+        ranked = self.index().search(term)
+        if not ranked:
+            return query.filter(literal(False))
+        query = query.filter(Products.product_id.in_([product_id for product_id, _ in ranked]))
+        if rank:
+            query = query.order_by(self.relevance_key(term)[0])
+        return query
+
+    def suggest(self, term, limit):
+        index = self.index()
+        return [{'id': pid, 'name': index.name(pid)} for pid, _ in index.search(term, limit)]
+
+
+class ProductSearch:
+    """Picks a search backend for the configured database."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SEARCH_BACKEND", "auto")
+        backend = app.config["SEARCH_BACKEND"]
+        if backend == "auto":
+            uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+            backend = "postgres" if uri.startswith("postgresql") else "memory"
+        backend = app.extensions['product_search'] = (
+            PostgresSearchBackend() if backend == "postgres" else MemorySearchBackend()
+        )
+        logger.info(f"Product search backend: {backend.name}")
+
+    @property
+    def backend(self):
+        """The current app's search backend."""
+        return current_app.extensions['product_search']
+
+    def apply(self, query, term, rank=True):
+        """Filter `query` to products matching `term`; order by relevance if `rank`."""
+        return self.backend.apply(query, term, rank)
+
+    def relevance_key(self, term):
+        """Return `(expression, coerce)` that sorts matches for `term` best first, ascending."""
+        return self.backend.relevance_key(term)
+
+    def suggest(self, term, limit=8):
+        """Return up to `limit` `{'id', 'name'}` dicts for type-ahead."""
+        if not term.strip():
+            return []
+        return self.backend.suggest(term, limit)
+
+
+product_search = ProductSearch()
@@ -34,18 +34,17 @@
         return $('meta[name="csrf-token"]').attr('content') || $('input[name="csrf_token"]').val() || '';
     };
 
-    // Fetch cart from server
-    const fetchCart = async () => {
+    // Fetch cart totals (and optionally the items) from the JSON summary endpoint
+    const fetchCartSummary = async (withItems = false) => {
         let attempt = 1;
         while (attempt <= CONFIG.maxAjaxRetries) {
             try {
-                const response = await $.get('/cart', { _t: Date.now() }, null, 'json');
-                return response.cart || [];
+                return await $.get('/cart/summary', withItems ? { items: 1, _t: Date.now() } : { _t: Date.now() }, null, 'json');
             } catch (e) {
                 console.error(`Attempt ${attempt} to fetch cart failed:`, e);
                 if (attempt === CONFIG.maxAjaxRetries) {
                     showError('Unable to load cart. Please try again.');
-                    return [];
+                    return { cart: [], item_count: 0, subtotal: 0, shipping: 0, discount: 0, total: 0 };
                 }
                 attempt++;
                 await new Promise(resolve => setTimeout(resolve, CONFIG.retryDelay));
@@ -53,11 +52,16 @@
         }
     };
 
+    // Fetch cart from server
+    const fetchCart = async () => {
+        const summary = await fetchCartSummary(true);
+        return summary.cart || [];
+    };
+
     // Update cart badge
     const updateCartBadge = async () => {
         try {
-            const cart = await fetchCart();
-            const totalItems = cart.reduce((sum, item) => sum + (item.quantity || 0), 0);
+            const { item_count: totalItems = 0 } = await fetchCartSummary();
             $('.fas.fa-shopping-cart + .badge').text(totalItems).attr('aria-label', `Cart contains ${totalItems} items`);
         } catch (e) {
             console.error('Failed to update cart badge:', e);
@@ -140,11 +144,7 @@
 
     // Update cart summary
     const updateSummary = async () => {
-        const cart = await fetchCart();
-        const subtotal = cart.reduce((sum, item) => sum + (item.price * item.quantity), 0);
-        const couponDiscount = parseFloat(localStorage.getItem('couponDiscount')) || 0; // Fallback until server-side
-        const shipping = cart.length > 0 ? CONFIG.shippingCost : 0;
-        const total = Math.max(0, subtotal - couponDiscount + shipping);
+        const { subtotal, discount: couponDiscount, shipping, total } = await fetchCartSummary();
 
         $('#subtotal').text(formatCurrency(subtotal));
         $('#coupon-discount').text(couponDiscount > 0 ? `-${formatCurrency(couponDiscount)}` : formatCurrency(0));
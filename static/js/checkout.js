@@ -8,7 +8,9 @@
         renderDelay: 100,
         shippingCost: 10,
         maxAjaxRetries: 3,
-        retryDelay: 1000
+        retryDelay: 1000,
+        orderPollInterval: 1000,
+        orderPollTimeout: 60000
     };
 
     // Reuse utilities from main.js
@@ -76,6 +78,23 @@
         `).show();
     };
 
+    // Poll a queued order until the workers have written its sale
+    const waitForOrder = async (statusUrl) => {
+        const deadline = Date.now() + CONFIG.orderPollTimeout;
+        while (Date.now() < deadline) {
+            await new Promise(resolve => setTimeout(resolve, CONFIG.orderPollInterval));
+            try {
+                const status = await $.get(statusUrl, { _t: Date.now() }, null, 'json');
+                if (status.status === 'completed' || status.status === 'failed') {
+                    return status;
+                }
+            } catch (e) {
+                console.error('Failed to fetch order status:', e);
+            }
+        }
+        return null;
+    };
+
     // Render a single order item
     const renderOrderItem = (item) => {
         const itemTotal = (item.price * item.quantity).toFixed(2);
@@ -289,6 +308,20 @@
                         contentType: 'application/json',
                         dataType: 'json'
                     });
+                    if (response.status_url) {
+                        // Asynchronous checkout: the order is queued, wait for its sale
+                        showError(`Order received! Order ID: ${sanitizeInput(response.order_id)}. Confirming...`, true);
+                        const status = await waitForOrder(response.status_url);
+                        if (!status) {
+                            showError(`Your order ${sanitizeInput(response.order_id)} is still being processed. We will confirm it by email.`, true);
+                            return;
+                        }
+                        if (status.status === 'failed') {
+                            showError('We could not complete your order. Please try again.');
+                            return;
+                        }
+                        response.sale_id = status.sale_id;
+                    }
                     showError(`Order placed successfully! Order ID: ${response.sale_id}`, true);
                     window.location.href = 'index.html';
                     return;
@@ -160,18 +160,17 @@
         return { products: paginated, totalPages, currentPage: page };
     };
 
-    // Fetch cart from server
-    const fetchCart = async () => {
+    // Fetch cart totals (and optionally the items) from the JSON summary endpoint
+    const fetchCartSummary = async (withItems = false) => {
         let attempt = 1;
         while (attempt <= CONFIG.maxAjaxRetries) {
             try {
-                const response = await $.get('/cart', { _t: Date.now() }, null, 'json');
-                return response.cart || [];
+                return await $.get('/cart/summary', withItems ? { items: 1, _t: Date.now() } : { _t: Date.now() }, null, 'json');
             } catch (e) {
                 console.error(`Attempt ${attempt} to fetch cart failed:`, e);
                 if (attempt === CONFIG.maxAjaxRetries) {
                     showError('Unable to load cart. Please try again.');
-                    return [];
+                    return { cart: [], item_count: 0, subtotal: 0, shipping: 0, discount: 0, total: 0 };
                 }
                 attempt++;
                 await new Promise(resolve => setTimeout(resolve, CONFIG.retryDelay));
@@ -179,11 +178,16 @@
         }
     };
 
+    // Fetch cart from server
+    const fetchCart = async () => {
+        const summary = await fetchCartSummary(true);
+        return summary.cart || [];
+    };
+
     // Update cart badge
     const updateCartBadge = async () => {
         try {
-            const cart = await fetchCart();
-            const totalItems = cart.reduce((sum, item) => sum + (item.quantity || 0), 0);
+            const { item_count: totalItems = 0 } = await fetchCartSummary();
             $('.fas.fa-shopping-cart + .badge').text(totalItems).attr('aria-label', `Cart contains ${totalItems} items`);
         } catch (e) {
             console.error('Failed to update cart badge:', e);
@@ -383,11 +387,30 @@
         });
     };
 
+    // Fetch "frequently bought together" products; empty until they have been computed
+    const fetchRecommendations = async (productId) => {
+        try {
+            const response = await fetch(`${CONFIG.productsUrl}/${encodeURIComponent(productId)}/recommendations?limit=3`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}`);
+            }
+            const data = await response.json();
+            return Array.isArray(data) ? data : [];
+        } catch (error) {
+            console.error('Failed to fetch recommendations:', error.message);
+            return [];
+        }
+    };
+
     // Render detail page
-    const renderDetailPage = () => {
+    const renderDetailPage = async () => {
         const { id } = getUrlParams();
         const product = products.find(p => p.id === id) || products[0] || {};
-        const relatedProducts = products.filter(p => p.id !== product.id && p.category === product.category).slice(0, 3);
+        const recommended = product.id ? await fetchRecommendations(product.id) : [];
+        // Fall back to the same category when there are no co-purchases yet
+        const relatedProducts = recommended.length
+            ? recommended
+            : products.filter(p => p.id !== product.id && p.category === product.category).slice(0, 3);
 
         renderProductDetails(product);
         renderProductCarousel(product, relatedProducts);
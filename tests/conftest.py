@@ -0,0 +1,54 @@
+import os
+import sys
+from decimal import Decimal
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_app
+from db import db, Customers, Products
+
+
+@pytest.fixture
+def app_config(tmp_path):
+    """Config overrides for `app`; override this fixture to add more."""
+    return {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'shop.db'}",
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'ROLLUP_REFRESH_INTERVAL': 0,
+    }
+
+
+@pytest.fixture
+def app(app_config):
+    """An app on a fresh SQLite database, with an app context pushed."""
+    app = create_app(app_config)
+    with app.app_context():
+        # Just the primary: a replica bind registered by an earlier app stays in db.metadatas
+        db.create_all(bind_key=None)
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def products(app):
+    """Two products with 100 units of stock each."""
+    rows = [
+        Products(product_id=product_id, product_name=f"Product {product_id}", buying_price=Decimal('8'),
+                 selling_price=Decimal('10'), stock_quantity=100, image='', category='test',
+                 rating=5, description='')
+        for product_id in (1, 2)
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+@pytest.fixture
+def customer(app):
+    customer = Customers(full_name='Test Customer', phone_no='0700000000', email='test@example.com')
+    db.session.add(customer)
+    db.session.commit()
+    return customer
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from db import db, RollupState, Sales
+from db_helpers import advance_sale_watermark, next_sale_batch, sale_watermark
+
+SETTLE = timedelta(seconds=30)
+
+
+def add_sale(customer, age):
+    sale = Sales(customer_id=customer.customer_id, total_amount=Decimal('10'),
+                 created_at=datetime.utcnow() - age)
+    db.session.add(sale)
+    db.session.flush()
+    return sale.sale_id
+
+
+def test_sale_watermark_is_created_at_zero(app):
+    state = sale_watermark('sales')
+    db.session.commit()
+    assert state.last_sale_id == 0
+    assert sale_watermark('sales') is state
+    assert db.session.query(RollupState).count() == 1
+
+
+def test_next_sale_batch_is_empty_without_new_sales(app, customer):
+    assert next_sale_batch(0, 100, SETTLE) == (None, 0)
+    sale_id = add_sale(customer, timedelta(minutes=5))
+    assert next_sale_batch(sale_id, 100, SETTLE) == (None, 0)
+
+
+def test_next_sale_batch_stops_at_batch_size(app, customer):
+    ids = [add_sale(customer, timedelta(minutes=5)) for _ in range(5)]
+    assert next_sale_batch(0, 3, SETTLE) == (ids[2], 3)
+    assert next_sale_batch(ids[2], 3, SETTLE) == (ids[4], 2)
+
+
+def test_next_sale_batch_stops_before_unsettled_sales(app, customer):
+    settled = add_sale(customer, timedelta(minutes=5))
+    add_sale(customer, timedelta(seconds=1))
+    # An older sale with a higher id, committed late, must wait behind the young one
+    add_sale(customer, timedelta(minutes=5))
+    assert next_sale_batch(0, 100, SETTLE) == (settled, 1)
+    assert next_sale_batch(settled, 100, SETTLE) == (None, 0)
+
+
+def test_sales_default_to_a_utc_timestamp(app, customer):
+    sale = Sales(customer_id=customer.customer_id, total_amount=Decimal('10'))
+    db.session.add(sale)
+    db.session.flush()
+    assert abs(sale.created_at - datetime.utcnow()) < timedelta(seconds=5)
+    assert next_sale_batch(0, 100, SETTLE) == (None, 0)
+
+
+def test_advance_sale_watermark_is_guarded_on_the_old_mark(app):
+    sale_watermark('sales')
+    db.session.commit()
+    assert advance_sale_watermark('sales', 0, 10)
+    # A second worker that read the same mark loses
+    assert not advance_sale_watermark('sales', 0, 12)
+    db.session.commit()
+    state = db.session.get(RollupState, 'sales')
+    db.session.refresh(state)
+    assert state.last_sale_id == 10
+    assert state.updated_at is not None
+
+
+def test_advance_sale_watermark_leaves_other_marks_alone(app):
+    sale_watermark('sales')
+    sale_watermark('co_purchases')
+    assert advance_sale_watermark('co_purchases', 0, 7)
+    db.session.commit()
+    db.session.expire_all()
+    assert db.session.get(RollupState, 'sales').last_sale_id == 0
+    assert db.session.get(RollupState, 'co_purchases').last_sale_id == 7
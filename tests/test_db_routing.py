@@ -0,0 +1,72 @@
+import sqlite3
+import pytest
+from flask import g
+from sqlalchemy import select
+from db import db, Products
+from db_routing import db_router, PRIMARY, REPLICA
+
+
+@pytest.fixture
+def app_config(app_config, tmp_path):
+    return dict(app_config, SQLALCHEMY_BINDS={REPLICA: f"sqlite:///{tmp_path / 'replica.db'}"})
+
+
+@pytest.fixture
+def replica(app, products, tmp_path):
+    """Copy the primary into the replica, then give the primary a product the replica lacks."""
+    source = sqlite3.connect(tmp_path / 'shop.db')
+    target = sqlite3.connect(tmp_path / 'replica.db')
+    with target:
+        source.backup(target)
+    source.close()
+    target.close()
+    db.session.add(Products(product_id=3, product_name='Primary only', buying_price=1, selling_price=2,
+                            stock_quantity=1))
+    db.session.commit()
+    return db.engines[REPLICA]
+
+
+def product_ids():
+    return db.session.scalars(select(Products.product_id).order_by(Products.product_id)).all()
+
+
+def test_reads_stay_on_primary_outside_replica_views(app, replica):
+    with app.test_request_context():
+        assert product_ids() == [1, 2, 3]
+
+
+def test_replica_view_reads_from_replica(app, replica):
+    with app.test_request_context():
+        g.db_route = REPLICA
+        assert db.session.get_bind(clause=select(Products)) is replica
+        assert product_ids() == [1, 2]
+
+
+def test_locking_reads_and_writes_go_to_primary(app, replica):
+    with app.test_request_context():
+        g.db_route = REPLICA
+        assert db.session.get_bind(clause=select(Products).with_for_update()) is db.engine
+        db.session.get(Products, 1).stock_quantity = 99
+        db.session.flush()
+        # Reads after a write in the same transaction see the primary
+        assert product_ids() == [1, 2, 3]
+        db.session.rollback()
+        assert product_ids() == [1, 2]
+
+
+def test_primary_block_overrides_replica_route(app, replica):
+    with app.test_request_context():
+        g.db_route = REPLICA
+        with db_router.primary():
+            assert g.db_route == PRIMARY
+            assert product_ids() == [1, 2, 3]
+        assert g.db_route == REPLICA
+
+
+def test_session_sticks_to_primary_after_a_write(app, replica):
+    view = db_router.replica_reads(lambda: (g.db_route, product_ids()))
+    with app.test_request_context():
+        assert view() == (REPLICA, [1, 2])
+    with app.test_request_context():
+        db_router.stick_to_primary()
+        assert view() == (PRIMARY, [1, 2, 3])
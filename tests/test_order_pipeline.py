@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select, update
+from db import db, OrderIntents, Products, Sales, StockReservations, StockShards
+from inventory import inventory, CONFIRMED
+from order_pipeline import order_pipeline, COMPLETED, FAILED, PENDING, PROCESSING
+
+
+@pytest.fixture
+def app(app):
+    app.config['ORDER_PIPELINE'] = 'async'
+    return app
+
+
+def queue_order(product_id=1, quantity=2, sharded=False, owner='cart-a'):
+    """Reserve stock and queue an intent the way asynchronous checkout does; returns its order_ref."""
+    order_ref = order_pipeline.new_order_ref()
+    if sharded:
+        assert inventory.confirm(owner, product_id, quantity, order_ref=order_ref)
+    else:
+        db.session.execute(
+            update(Products).where(Products.product_id == product_id)
+            .values(stock_quantity=Products.stock_quantity - quantity)
+        )
+    order_pipeline.submit(order_ref, {
+        'cart_id': owner,
+        'customer': {'email': 'buyer@example.com', 'full_name': 'Test Buyer', 'phone_no': '0700000000'},
+        'payment_method': 'card',
+        'total': str(10 * quantity),
+        'created_at': datetime.utcnow().isoformat(),
+        'lines': [{'product_id': product_id, 'quantity': quantity, 'amount': str(10 * quantity)}],
+        'stock': [[product_id, quantity]],
+        'sharded': [product_id] if sharded else []
+    })
+    db.session.commit()
+    return order_ref
+
+
+def intent(order_ref):
+    db.session.expire_all()
+    return db.session.execute(select(OrderIntents).where(OrderIntents.order_ref == order_ref)).scalar_one()
+
+
+def stock(product_id):
+    db.session.expire_all()
+    return db.session.get(Products, product_id).stock_quantity
+
+
+def fail_materialize(monkeypatch):
+    def boom(order_ref, payload):
+        raise RuntimeError('payment gateway down')
+    monkeypatch.setattr(order_pipeline, '_materialize', boom)
+
+
+def test_process_batch_completes_queued_order(app, products):
+    order_ref = queue_order()
+    assert order_pipeline.status(order_ref) == {'status': PENDING, 'sale_id': None}
+
+    assert order_pipeline.process_batch() == 1
+    assert order_pipeline.process_batch() is None
+
+    row = intent(order_ref)
+    assert row.status == COMPLETED
+    assert row.attempts == 1
+    assert db.session.get(Sales, row.sale_id) is not None
+    assert stock(1) == 98
+
+
+def test_claim_leases_intents_to_one_token(app, products):
+    first, second = queue_order(), queue_order()
+
+    token, claimed = order_pipeline._claim(10)
+    assert [row.order_ref for row in claimed] == [first, second]
+    assert all(intent(order_ref).claimed_by == token for order_ref in (first, second))
+    assert intent(first).status == PROCESSING
+
+    # Leased intents are not handed to another worker until the lease runs out
+    assert order_pipeline._claim(10)[1] == []
+
+
+def test_expired_lease_is_claimed_again(app, products):
+    order_ref = queue_order()
+    old_token, _ = order_pipeline._claim(10)
+    db.session.execute(update(OrderIntents).values(locked_until=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+    new_token, claimed = order_pipeline._claim(10)
+    assert new_token != old_token
+    assert [row.order_ref for row in claimed] == [order_ref]
+    assert intent(order_ref).attempts == 2
+
+
+def test_stale_claim_loses_to_the_new_one(app, products, monkeypatch, caplog):
+    order_ref = queue_order()
+    old_token, claimed = order_pipeline._claim(10)
+    db.session.execute(update(OrderIntents).values(locked_until=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+    new_token, _ = order_pipeline._claim(10)
+
+    # The worker whose lease expired finishes late: its sale is rolled back (LostClaim)
+    monkeypatch.setattr(order_pipeline, '_claim', lambda limit: (old_token, claimed))
+    assert order_pipeline.process_batch() == 0
+    assert 'reclaimed by another worker' in caplog.text
+    assert intent(order_ref).status == PROCESSING
+    assert db.session.scalar(select(func.count()).select_from(Sales)) == 0
+
+    claimed = [intent(order_ref)]
+    monkeypatch.setattr(order_pipeline, '_claim', lambda limit: (new_token, claimed))
+    assert order_pipeline.process_batch() == 1
+    assert intent(order_ref).status == COMPLETED
+    assert db.session.scalar(select(func.count()).select_from(Sales)) == 1
+
+
+def test_failed_intent_is_retried(app, products, monkeypatch):
+    order_ref = queue_order()
+    fail_materialize(monkeypatch)
+
+    assert order_pipeline.process_batch() == 0
+    row = intent(order_ref)
+    assert row.status == PENDING
+    assert row.error == 'payment gateway down'
+    assert row.locked_until is None
+    assert stock(1) == 98
+
+    monkeypatch.undo()
+    assert order_pipeline.process_batch() == 1
+    row = intent(order_ref)
+    assert row.status == COMPLETED
+    assert row.attempts == 2
+    assert row.error is None
+
+
+def test_intent_fails_after_max_attempts_and_restocks(app, products, monkeypatch):
+    app.config['ORDER_MAX_ATTEMPTS'] = 2
+    order_ref = queue_order()
+    fail_materialize(monkeypatch)
+
+    assert order_pipeline.process_batch() == 0
+    assert intent(order_ref).status == PENDING
+    assert order_pipeline.process_batch() == 0
+    assert intent(order_ref).status == FAILED
+    assert stock(1) == 100
+    assert order_pipeline.process_batch() is None
+
+
+def test_one_bad_intent_does_not_roll_back_the_batch(app, products, monkeypatch):
+    good, bad = queue_order(product_id=1), queue_order(product_id=2)
+    materialize = order_pipeline._materialize
+
+    def flaky(order_ref, payload):
+        if order_ref == bad:
+            raise RuntimeError('payment gateway down')
+        return materialize(order_ref, payload)
+    monkeypatch.setattr(order_pipeline, '_materialize', flaky)
+
+    assert order_pipeline.process_batch() == 1
+    assert intent(good).status == COMPLETED
+    assert intent(bad).status == PENDING
+
+
+def test_sharded_orders_from_one_cart_keep_their_own_units(app, products, monkeypatch):
+    inventory.shard(1, 4)
+    db.session.commit()
+    first = queue_order(quantity=2, sharded=True)
+    second = queue_order(quantity=3, sharded=True)
+    shards = lambda: db.session.scalar(select(func.sum(StockShards.quantity)))
+    assert shards() == 95
+
+    app.config['ORDER_MAX_ATTEMPTS'] = 1
+    assert order_pipeline.process_batch(limit=1) == 1
+    fail_materialize(monkeypatch)
+    assert order_pipeline.process_batch(limit=1) == 0
+
+    # Only the failed order's units go back; the completed order's stay sold
+    assert shards() == 98
+    reservations = db.session.execute(
+        select(StockReservations.order_ref, StockReservations.quantity, StockReservations.sale_id)
+        .where(StockReservations.status == CONFIRMED)
+    ).all()
+    assert {(row.order_ref, row.sale_id) for row in reservations} == {(first, intent(first).sale_id)}
+    assert sum(row.quantity for row in reservations) == 2
+    assert intent(second).status == FAILED